@@ -0,0 +1,310 @@
+"""Script generating DIPs for many Intellectual Entities without the Request Viewer GUI.
+
+The script reads a manifest of requests and passes each of them to DIPRequestHandler.startrequest.
+It doesn't import Qt, so it can run on machines without a graphical environment (e.g. overnight
+on a server).
+
+The manifest is either a .json file containing a list of objects or a .csv file (delimiter ",")
+with a header row. Each entry (object resp. row) has the following keys:
+    * "aips": The paths to the AIP .tar files of one IE (a list in .json, separated by ";" in .csv),
+      or the path to a directory containing them.
+    * "output": The path of the directory, to which the (View)DIP shall be saved (created, if missing).
+    * "profile": The number of the DIP profile (optional, default: the default profile).
+    * "delivery": "viewer", "download" or "both" (optional, default: the profile's default delivery).
+    * "select": Which of the AIPs found in an "aips" directory are requested ("all", "frame" or
+      "latest", optional, default: the profile's default AIPs). Ignored for lists of AIPs.
+    * "id": An ID of the entry used in the result log (optional, default: a hash of the other keys).
+
+The manifest is checked for unknown profiles and delivery types before any request is started.
+The result of each entry is appended as JSON object to a JSON-lines log file. When the script is
+started again with the same log file, entries already logged as successful are skipped, so an
+interrupted batch can be resumed. If a worker process crashes, all entries not done yet are logged
+as failed.
+
+Usage (from the repository root):
+    python batch.py <manifest> [--log <results.jsonl>] [--workers 4] [--index cache/aipindex.sqlite]
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from drh.drh import DIPRequestHandler, DrhResponse
+from drh.err import DrhError, NoPathError
+
+os.environ['SAXONC_HOME'] = os.path.join(os.getcwd(), "saxonpy", "saxonc_home")
+
+CONFDIR = "config/DIP/"
+CONF = "profile_conf.json"
+DELIVERIES = ("viewer", "download", "both")
+VCONFDIR = "config/VDIP/"
+VCONF = "profile_conf.json"
+
+# The DIPRequestHandler of the current (worker) process, see inithandler
+handler = None
+
+
+def loadprofilenos() -> list[int]:
+    """Return the numbers of the DIP profiles in the profile config."""
+    with open(os.path.join(CONFDIR, CONF), "r", encoding="utf-8") as f:
+        return [pc["profileMetadata"]["profileNumber"] for pc in json.load(f)["profileConfigs"]]
+
+
+def loadmanifest(path: str) -> list[dict]:
+    """Load and check the entries of the given .json or .csv manifest.
+
+    :param path: The path to the manifest file.
+    :return: The entries as list of dictionaries, each with an "id".
+    :raise ValueError: If an entry has an unknown profile or delivery type.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            entries = [{k: v for k, v in row.items() if v} for row in csv.DictReader(f)]
+        for e in entries:
+            if ";" in e.get("aips", "") or not os.path.isdir(e.get("aips", "")):
+                e["aips"] = [p.strip() for p in e.get("aips", "").split(";") if p.strip()]
+            if "profile" in e:
+                try:
+                    e["profile"] = int(e["profile"])
+                except ValueError:
+                    raise ValueError("Invalid profile in manifest entry " + json.dumps(e, ensure_ascii=False))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+
+    for e in entries:
+        if "id" not in e:
+            key = json.dumps({k: e.get(k) for k in ("aips", "output", "profile", "delivery", "select")},
+                             sort_keys=True)
+            e["id"] = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    # Typos are reported before any request is started, not deep inside the DIPRequestHandler
+    nos = loadprofilenos()
+    for e in entries:
+        if "profile" in e and e["profile"] not in nos:
+            raise ValueError(f"Unknown profile {e['profile']} in entry {e['id']} (known: {nos})")
+        if "delivery" in e and e["delivery"] not in DELIVERIES:
+            raise ValueError(f"Unknown delivery {e['delivery']!r} in entry {e['id']} (known: {', '.join(DELIVERIES)})")
+    return entries
+
+
+def loaddone(log: str) -> set[str]:
+    """Return the IDs of all entries logged as successful in the given result log.
+
+    An incomplete last line (e.g. after the script was killed) is ignored.
+    """
+    done = set()
+    if not os.path.exists(log):
+        return done
+    with open(log, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+
+def inithandler(index: str | None):
+    """Initialize the DIPRequestHandler of the current process.
+
+    :param index: The path to the AIP index database file (optional).
+    """
+    global handler
+    if multiprocessing.parent_process() is not None:
+        # Interrupts are handled by the main process, which lets running requests finish
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    handler = DIPRequestHandler(CONFDIR, CONF, VCONFDIR, VCONF, indexpath=index)
+
+
+def choices(entry: dict) -> (dict | None, list[DrhError]):
+    """Return the user choice dictionary for DIPRequestHandler.startrequest for the given manifest entry.
+
+    :return: A tuple containing first the user choices (None, if the AIPs of an "aips" directory couldn't
+        be loaded) and second the DrhErrors raised while loading them.
+    :raise ValueError: If the entry is incomplete or requests something, its profile doesn't allow.
+    """
+    if not entry.get("aips") or not entry.get("output"):
+        raise ValueError("The entry needs the keys \"aips\" and \"output\".")
+
+    nos = handler.getprofileinfo()["nos"]
+    if "profile" in entry:
+        if entry["profile"] not in nos:
+            raise ValueError("Unknown profile: " + str(entry["profile"]))
+        no = nos.index(entry["profile"])
+    else:
+        no = handler.getdefaultprofile()
+
+    delivery = entry.get("delivery", handler.getdefaultdelivery(no))
+    if delivery != handler.getdefaultdelivery(no) and not handler.deliverychoice(no):
+        raise ValueError("Profile " + str(nos[no]) + " only allows the delivery " + handler.getdefaultdelivery(no))
+
+    aips = entry["aips"]
+    if not isinstance(aips, list):
+        info = handler.getaipinfo(aips)
+        if any(e.isfatal() for e in info.geterrors()) or not info.getinfo():
+            return None, info.geterrors() or [NoPathError(aips)]
+        paths = [a["path"] for a in info.getinfo()["aipinfo"]]
+        select = entry.get("select", handler.getdefaultaips(no))
+        if select == "frame":
+            aips = paths[:1] + paths[1:][-1:]
+        elif select == "latest":
+            aips = paths[-1:]
+        else:
+            aips = paths
+
+    os.makedirs(entry["output"], exist_ok=True)
+    return {
+        "vzePath": None,
+        "profileNo": no,
+        "deliveryType": delivery,
+        "outputPath": entry["output"],
+        "chosenAips": aips
+    }, []
+
+
+def result(entry: dict, resp: DrhResponse, start: float) -> dict:
+    """Return the result of the given manifest entry as JSON serializable dictionary.
+
+    :param entry: The manifest entry.
+    :param resp: The response of the entry's request.
+    :param start: The time (as UNIX timestamp), when the request was started.
+    """
+    full = resp.getfullresponse()
+    return {
+        "id": entry["id"],
+        "status": "failed" if full["errors"] else "ok",
+        "success": full["success"],
+        "errors": [e.todict() for e in full["errors"]],
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start)),
+        "duration": round(time.time() - start, 3)
+    }
+
+
+def run(entry: dict) -> dict:
+    """Execute the request of the given manifest entry and return its result as JSON serializable dictionary."""
+    start = time.time()
+    try:
+        uchoices, errors = choices(entry)
+        if uchoices is not None:
+            resp = handler.startrequest(uchoices)
+        else:
+            resp = DrhResponse()
+            resp.newerror(errors)
+    except ValueError as e:
+        resp = DrhResponse()
+        resp.newerror(DrhError(str(e), True))
+    except Exception as e:
+        resp = DrhResponse()
+        resp.newerror(DrhError("".join(traceback.format_exception(e, limit=10)), True))
+    return result(entry, resp, start)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest", help="Path to the .json or .csv manifest.")
+    parser.add_argument("--log", help="Path to the JSON-lines result log (default: <manifest>.results.jsonl).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of requests executed in parallel processes.")
+    parser.add_argument("--index", default=None, help="Path to the AIP index database file (optional).")
+    args = parser.parse_args()
+
+    log = args.log or os.path.splitext(args.manifest)[0] + ".results.jsonl"
+    try:
+        entries = loadmanifest(args.manifest)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    done = loaddone(log)
+    todo = [e for e in entries if e["id"] not in done]
+    print(f"{len(entries)} entries, {len(entries) - len(todo)} already done, {len(todo)} to do", file=sys.stderr)
+
+    failed = 0
+    with open(log, "a", encoding="utf-8") as f:
+        def record(n: int, result: dict):
+            nonlocal failed
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.flush()
+            failed += result["status"] != "ok"
+            print(f"[{n}/{len(todo)}] {result['id']}: {result['status']}", file=sys.stderr)
+
+        if args.workers <= 1:
+            try:
+                inithandler(args.index)
+                for n, e in enumerate(todo, 1):
+                    record(n, run(e))
+            except KeyboardInterrupt:
+                print("Interrupted, start again with the same log to resume.", file=sys.stderr)
+                return 130
+            return 1 if failed else 0
+
+        # Each worker process has its own DIPRequestHandler (incl. caches and XSLT processor).
+        # At most two entries per worker are submitted at once, so an interrupt only waits for few requests.
+        executor = ProcessPoolExecutor(args.workers, initializer=inithandler, initargs=(args.index,))
+        pending = set()
+        submitted = {}
+        unsubmitted = []
+        queue = iter(todo)
+        n = 0
+        try:
+            while True:
+                for e in queue:
+                    unsubmitted = [e]
+                    future = executor.submit(run, e)
+                    submitted[future] = e
+                    unsubmitted = []
+                    pending.add(future)
+                    if len(pending) >= 2 * args.workers:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    res = future.result()
+                    n += 1
+                    record(n, res)
+                    del submitted[future]
+        except BrokenProcessPool as e:
+            # A worker process died (e.g. killed by the OS): the entries not done yet are logged as failed,
+            # so that the batch can be resumed with the same log
+            print("A worker process crashed, the remaining entries are logged as failed.", file=sys.stderr)
+            resp = DrhResponse()
+            resp.newerror(DrhError("Worker process crashed: " + str(e), True))
+            for future, entry in submitted.items():
+                n += 1
+                if future.done() and future.exception() is None:
+                    record(n, future.result())
+                else:
+                    record(n, result(entry, resp, time.time()))
+            for entry in itertools.chain(unsubmitted, queue):
+                n += 1
+                record(n, result(entry, resp, time.time()))
+            return 1
+        except KeyboardInterrupt:
+            print("Interrupted, waiting for the running requests to finish...", file=sys.stderr)
+            executor.shutdown(cancel_futures=True)
+            for future in pending:
+                if not future.cancelled():
+                    n += 1
+                    record(n, future.result())
+            print("Start again with the same log to resume.", file=sys.stderr)
+            return 130
+        finally:
+            executor.shutdown()
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
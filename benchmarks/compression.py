@@ -0,0 +1,100 @@
+"""Throughput benchmark for the compression of Information Package .tar files.
+
+Packs a synthetic AIP with TarPacker using different codecs and thread counts,
+checks that each result can be read back with tarfile (and has the original content)
+and prints the throughput (uncompressed MiB per second) and the compression ratio.
+
+Usage (from the repository root):
+    python benchmarks/compression.py [--size 256] [--threads 1 2 4 8] [--codecs gzip bz2 xz zstd]
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import random
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from drh.pack import Compression, TarPacker, zstandard
+
+FILESIZE = 4 * 1024 * 1024
+
+
+def makeaip(path: str, size: int) -> dict[str, str]:
+    """Write a synthetic AIP .tar file with moderately compressible payload files of the given total size.
+
+    :param path: The path of the .tar file.
+    :param size: The total size of the payload in MiB.
+    :return: The SHA-256 hashes of the payload files by name.
+    """
+    rnd = random.Random(0)
+    words = [bytes(rnd.choices(b"abcdefghijklmnopqrstuvwxyz", k=rnd.randint(2, 12))) for _ in range(5000)]
+    hashes = {}
+    with tarfile.open(path, "w") as tar:
+        for n in range(size * 1024 * 1024 // FILESIZE):
+            data = bytearray()
+            while len(data) < FILESIZE:
+                data += b" ".join(rnd.choices(words, k=64)) + b"\n"
+                data += rnd.randbytes(64)
+            data = bytes(data[:FILESIZE])
+            info = tarfile.TarInfo(f"object{n}.txt")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            hashes[info.name] = hashlib.sha256(data).hexdigest()
+    return hashes
+
+
+def check(path: str, codec: str, hashes: dict[str, str]) -> bool:
+    """Return whether the given .tar file contains exactly the given payload files."""
+    if codec == "zstd":
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        tar = tarfile.open(fileobj=raw, mode="r|")
+    else:
+        tar = tarfile.open(path, "r:*")
+    with tar:
+        found = {m.name: hashlib.sha256(tar.extractfile(m).read()).hexdigest() for m in tar}
+    return found == hashes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=256, help="Size of the synthetic payload in MiB.")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="Thread counts.")
+    parser.add_argument("--codecs", nargs="+", default=["gzip", "bz2", "xz", "zstd"], help="Codecs.")
+    parser.add_argument("--level", type=int, default=None, help="Compression level (default: codec default).")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as temp:
+        src = os.path.join(temp, "aip.tar")
+        hashes = makeaip(src, args.size)
+        with tarfile.open(src) as tar:
+            members = tar.getmembers()
+        print(f"{os.cpu_count()} CPUs, {args.size} MiB payload")
+        print(f"{'codec':<8}{'threads':>8}{'MiB/s':>10}{'ratio':>8}  readable")
+        for codec in args.codecs:
+            if codec == "zstd" and zstandard is None:
+                print(f"{codec:<8}  skipped (zstandard is not installed)")
+                continue
+            for threads in args.threads:
+                out = os.path.join(temp, f"out-{codec}-{threads}")
+                compression = Compression({"codec": codec, "level": args.level, "threads": threads})
+                start = time.perf_counter()
+                with TarPacker(out, compression=compression) as packer:
+                    packer.addmembers(src, members)
+                duration = time.perf_counter() - start
+                readable = check(packer.getpath(), codec, hashes)
+                failed = failed or not readable
+                ratio = os.path.getsize(src) / os.path.getsize(packer.getpath())
+                print(f"{codec:<8}{threads:>8}{args.size / duration:>10.1f}{ratio:>8.2f}  {'yes' if readable else 'NO'}")
+                os.remove(packer.getpath())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""Regression benchmark for the DIP profile stylesheets.
+
+Transforms a set of synthetic AIP metadata files with the profile stylesheets of the
+working tree and with those of a baseline revision, compares the results byte by byte
+and prints the time each transformation took.
+
+Usage (from the repository root):
+    python benchmarks/profiles.py --baseline <rev> [--aips 4] [--objects 2000] [--profiles 1 2 3]
+
+The baseline is a git revision (commit, tag or branch) reachable in the local repository,
+e.g. the tag of the last release, whose stylesheets are known to produce correct output.
+
+The exit code is 1, if the output of any profile differs from the baseline's output.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from saxonpy import PySaxonProcessor
+from drh.cache import XsltCache
+
+NS = "http://dips.bundesarchiv.de/schema"
+
+
+def makeaip(aipid: str, objects: list[str], items: int) -> str:
+    """Return the metadata .xml of a synthetic AIP.
+
+    The AIP contains the given objects and the given number of items. The objects are
+    distributed over the items, every item links its objects via linkingObjectIdentifiers.
+
+    :param aipid: The AIP's ID.
+    :param objects: The identifier values of the AIP's objects.
+    :param items: The number of items.
+    :return: The metadata .xml as string.
+    """
+    def ident(o: str, prefix: str) -> str:
+        type_ = "UUID" if int(o.rsplit("-", 1)[1]) % 2 else "local"
+        return (f"<{prefix}Type>{type_}</{prefix}Type>"
+                f"<{prefix}Value>{o}</{prefix}Value>")
+
+    links = {i: [] for i in range(items)}
+    for n, o in enumerate(objects):
+        links[n % items].append(o)
+    xitems = "".join(
+        f"<item><IID>item-{i}</IID><title>Item {i}</title>"
+        + "".join(f"<linkingObjectIdentifier>{ident(o, 'linkingObjectIdentifier')}</linkingObjectIdentifier>"
+                  for o in links[i])
+        + "</item>" for i in range(items))
+    xobjects = "".join(
+        f"<object><objectIdentifier>{ident(o, 'objectIdentifier')}</objectIdentifier>"
+        f"<preservationLevel>2</preservationLevel><objectCategory>Datei</objectCategory>"
+        f"<objectCharacteristics><compositionLevel>0</compositionLevel><size>1024</size>"
+        f"<format><formatDesignation><formatName>PDF/A</formatName></formatDesignation></format>"
+        f"<originalName>{o}.pdf</originalName></objectCharacteristics>"
+        f"<linkingEventIdentifier><linkingEventIdentifierType>local</linkingEventIdentifierType>"
+        f"<linkingEventIdentifierValue>ev-1</linkingEventIdentifierValue></linkingEventIdentifier></object>"
+        for o in objects)
+    return (f'<?xml version="1.0" encoding="UTF-8"?><dipsarch xmlns="{NS}">'
+            f"<AIP><AIPID>{aipid}</AIPID><Type>E-Akte</Type></AIP>"
+            f"<intellectualEntity><IEID>ie-1</IEID><title>Synthetic e-file</title><type>Sachakte</type>"
+            f"<extDescriptiveMetadataItem><IID>item-0</IID></extDescriptiveMetadataItem>{xitems}"
+            f"<date><dateStart>2020-01-01</dateStart><dateEnd>2021-01-01</dateEnd></date></intellectualEntity>"
+            f"<admin><provenance>Benchmark</provenance></admin>"
+            f"<technical>{xobjects}"
+            f"<event><eventIdentifier><eventIdentifierType>local</eventIdentifierType>"
+            f"<eventIdentifierValue>ev-1</eventIdentifierValue></eventIdentifier><eventType>ingest</eventType>"
+            f"<linkingAgentIdentifier><linkingAgentIdentifierType>local</linkingAgentIdentifierType>"
+            f"<linkingAgentIdentifierValue>ag-1</linkingAgentIdentifierValue></linkingAgentIdentifier></event>"
+            f"<agent><agentIdentifier><agentIdentifierType>local</agentIdentifierType>"
+            f"<agentIdentifierValue>ag-1</agentIdentifierValue></agentIdentifier></agent>"
+            f"<structure>flat</structure></technical></dipsarch>")
+
+
+def makeaips(dir_: str, aips: int, objects: int) -> list[str]:
+    """Write the metadata files of a chain of synthetic AIPs (of the same e-file) to the given directory.
+
+    Each AIP adds new objects to the objects of its predecessor, so that the last AIP
+    contains all objects, like the latest version of an e-file does.
+
+    :return: The paths of the metadata files, ordered by AIP index.
+    """
+    paths = []
+    for a in range(aips):
+        count = objects * (a + 1) // aips
+        path = os.path.join(dir_, f"aip-{a}.xml")
+        with open(path, "w", encoding="UTF-8") as f:
+            f.write(makeaip(f"aip-{a}", [f"obj-{o}" for o in range(count)], max(1, count // 10)))
+        paths.append(path)
+    return paths
+
+
+def baseline(rev: str, path: str, dir_: str) -> str:
+    """Write the given stylesheet as of the given git revision to the given directory and return its path."""
+    xsl = subprocess.run(["git", "show", rev + ":" + path], capture_output=True, check=True).stdout
+    out = os.path.join(dir_, "baseline-" + os.path.basename(path))
+    with open(out, "wb") as f:
+        f.write(xsl)
+    return out
+
+
+def run(xslts: XsltCache, xsl: str, output: str, params: dict) -> float:
+    """Transform with the given stylesheet (after compiling it) and return the duration in seconds."""
+    xslts.get(xsl)
+    start = time.perf_counter()
+    xslts.transform(xsl, output, params)
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--aips", type=int, default=4, help="Number of AIPs of the synthetic e-file.")
+    parser.add_argument("--objects", type=int, default=2000, help="Number of objects in the latest AIP.")
+    parser.add_argument("--baseline", required=True, help="Git revision (commit, tag or branch) of the baseline "
+                        "stylesheets.")
+    parser.add_argument("--profiles", type=int, nargs="+", default=[1, 2, 3], help="Numbers of the profiles.")
+    args = parser.parse_args()
+
+    proc = PySaxonProcessor(license=False)
+    xslts = XsltCache(proc)
+    failed = False
+    with tempfile.TemporaryDirectory() as temp:
+        params = {"aips": makeaips(temp, args.aips, args.objects)}
+        print(f"{'profile':<8}{'baseline [s]':>14}{'current [s]':>14}  output")
+        for p in args.profiles:
+            path = f"config/DIP/profiles/p{p}/p{p}_xsl.xsl"
+            params["vars"] = json.dumps({
+                "id": "bench", "profileNumber": p, "profileDescription": "", "profileVersion": "1.0",
+                "issuedBy": "bench", "generatorName": "bench", "generatorVersion": "0",
+                "generationDate": "2000-01-01.00h-00m-00s", "type": "UNIVERSAL", "schema": f"DIP-P{p}.xsd"})
+            old = os.path.join(temp, f"p{p}-baseline.xml")
+            new = os.path.join(temp, f"p{p}-current.xml")
+            told = run(xslts, baseline(args.baseline, path, temp), old, params)
+            tnew = run(xslts, path, new, params)
+            with open(old, "rb") as fold, open(new, "rb") as fnew:
+                identical = fold.read() == fnew.read()
+            failed = failed or not identical
+            print(f"p{p:<7}{told:>14.3f}{tnew:>14.3f}  {'identical' if identical else 'DIFFERENT'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
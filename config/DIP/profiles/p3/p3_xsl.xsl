@@ -14,29 +14,55 @@
     <xsl:output method="xml" indent="yes" encoding="UTF-8" standalone="yes"/>
     <xsl:mode on-no-match="shallow-copy"/>
 
-    <xsl:variable name="json" select="parse-json(unparsed-text('./vars.json'))"/>
+    <!-- The DIP's variables as JSON object and the metadata documents of its AIPs (set by the DIP generator) -->
+    <xsl:param name="vars" as="xs:string" required="yes"/>
+    <xsl:param name="aips" as="document-node()*" required="yes"/>
+
+    <xsl:variable name="json" select="parse-json($vars)"/>
     <!-- <xsl:variable name="vze" select="./vze.xml"/> -->
-    <xsl:variable name="aips" select="collection('./aips/')"/>
+
+    <!-- Items of the intellectualEntity by their IID combined with the type resp. value of their linked objects -->
+    <xsl:key name="items-by-type" match="dips:intellectualEntity/*"
+             use="for $i in dips:IID, $t in .//dips:linkingObjectIdentifierType return gen:key-of($i, $t)"/>
+    <xsl:key name="items-by-value" match="dips:intellectualEntity/*"
+             use="for $i in dips:IID, $v in .//dips:linkingObjectIdentifierValue return gen:key-of($i, $v)"/>
+    <xsl:key name="items-by-iid" match="dips:intellectualEntity/*" use="dips:IID"/>
+    <!-- Object identifiers by their value -->
+    <xsl:key name="objects-by-value" match="dips:object/dips:objectIdentifier" use="dips:objectIdentifierValue"/>
+
+    <!-- Combine two strings to an unambiguous key (the length prefix keeps ('ab', 'c') and ('a', 'bc') apart) -->
+    <xsl:function name="gen:key-of" as="xs:string">
+        <xsl:param name="a" as="xs:string"/>
+        <xsl:param name="b" as="xs:string"/>
+        <xsl:sequence select="string-length($a) || ':' || $a || $b"/>
+    </xsl:function>
+
+    <!-- The items of the given AIP with one of the given IIDs, that link an object with the given type and value -->
+    <xsl:function name="gen:linking-items" as="element()*">
+        <xsl:param name="aip" as="document-node()"/>
+        <xsl:param name="iid"/>
+        <xsl:param name="t"/>
+        <xsl:param name="v"/>
+        <xsl:sequence select="key('items-by-type', for $i in $iid, $x in $t return gen:key-of($i, $x), $aip)
+            intersect key('items-by-value', for $i in $iid, $x in $v return gen:key-of($i, $x), $aip)"/>
+    </xsl:function>
 
     <xsl:function name="gen:objects-by-iid">
         <xsl:param name="iid"/>
-        <xsl:for-each select="$aips[last()]//dips:object/dips:objectIdentifier">
+        <!-- Only the objects of the latest AIP, whose value is linked by any item with the IID, can match -->
+        <xsl:variable name="values" select="($aips ! key('items-by-iid', $iid, .))//dips:linkingObjectIdentifierValue"/>
+        <xsl:for-each select="key('objects-by-value', $values, $aips[last()])">
             <xsl:variable name="t" select="dips:objectIdentifierType"/>
             <xsl:variable name="v" select="dips:objectIdentifierValue"/>
-            <xsl:if test="$aips//dips:intellectualEntity/*[dips:IID = $iid
-            and .//dips:linkingObjectIdentifierType = $t
-            and .//dips:linkingObjectIdentifierValue = $v]">
+            <xsl:variable name="linking" select="$aips[exists(gen:linking-items(., $iid, $t, $v))]"/>
+            <xsl:if test="exists($linking)">
             <linkingObject xmlns="http://dips.bundesarchiv.de/schema">
                 <linkingObjectIdentifier>
                     <linkingObjectIdentifierType><xsl:value-of select="$t"/></linkingObjectIdentifierType>
                     <linkingObjectIdentifierValue><xsl:value-of select="$v"/></linkingObjectIdentifierValue>
                 </linkingObjectIdentifier>
-                <xsl:for-each select="$aips">
-                    <xsl:if test=".//dips:intellectualEntity/*[dips:IID = $iid
-                        and .//dips:linkingObjectIdentifierType = $t
-                        and .//dips:linkingObjectIdentifierValue = $v]">
-                        <linkingAIPIdentifier><xsl:value-of select=".//dips:AIPID"/></linkingAIPIdentifier>
-                    </xsl:if>
+                <xsl:for-each select="$linking">
+                    <linkingAIPIdentifier><xsl:value-of select=".//dips:AIPID"/></linkingAIPIdentifier>
                 </xsl:for-each>
             </linkingObject>
             </xsl:if>
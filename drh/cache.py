@@ -0,0 +1,351 @@
+"""Module for caches shared by the DIP Request Handler and its Information Packages."""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from lxml import etree
+from saxonpy import PySaxonProcessor, PyXdmValue, PyXslt30Processor
+
+if TYPE_CHECKING:
+    from drh.ip import AIP
+
+
+class SchemaCache:
+    """Cache of compiled XML schemas.
+
+    Each schema is compiled only once and reused, until its .xsd file is modified.
+    The cache counts hits and misses, which can be used for debugging and logging.
+    The cache can be shared by AIPs that are parsed in different threads.
+    """
+
+    _schemas: dict[str, tuple[float, etree.XMLSchema]]
+    _hits: int
+    _misses: int
+    _lock: threading.Lock
+
+    def __init__(self):
+        """Initialize and return an empty SchemaCache object."""
+        self._schemas = {}
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> etree.XMLSchema:
+        """Return the compiled schema for the given .xsd file.
+
+        The schema is compiled, if it isn't cached yet or if the .xsd file has been
+        modified since it was compiled (which is checked via the file's mtime).
+
+        :param path: The path to the .xsd file.
+        :return: The compiled schema.
+        """
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            cached = self._schemas.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._hits += 1
+                return cached[1]
+
+            self._misses += 1
+            schema = etree.XMLSchema(etree.parse(path))
+            self._schemas[path] = (mtime, schema)
+            return schema
+
+    def gethits(self) -> int:
+        """Return the number of requests that were answered from the cache."""
+        return self._hits
+
+    def getmisses(self) -> int:
+        """Return the number of requests that caused a schema to be compiled."""
+        return self._misses
+
+
+class AIPCache:
+    """Bounded LRU cache of parsed AIP objects.
+
+    The AIPs are cached with the path, size and mtime of their .tar files as key, so
+    that a replaced .tar file is parsed again instead of being served from the cache.
+    The cache is limited by a maximum number of entries and by a byte budget for the
+    AIPs' temporary metadata files. When one of the limits is exceeded, the least
+    recently used AIPs are evicted and their temporary files are deleted.
+
+    The cache can be shared by requests running in different threads. A request pins
+    the AIPs it uses, so that they aren't evicted while it is running. The temporary
+    files of a pinned AIP, that is replaced in the cache, are only deleted once the
+    AIP is unpinned by all requests.
+    """
+
+    _aips: OrderedDict[tuple, "AIP"]
+    _sizes: dict[tuple, int]
+    _keys: dict[str, tuple]
+    _maxentries: int
+    _maxbytes: int
+    _bytes: int
+    _pins: dict[tuple, int]
+    _retired: dict[tuple, list["AIP"]]
+    _lock: threading.RLock
+
+    def __init__(self, maxentries: int = 64, maxbytes: int = 512 * 1024 * 1024):
+        """Initialize and return an empty AIPCache object.
+
+        :param maxentries: The maximum number of cached AIPs.
+        :param maxbytes: The maximum combined size (in bytes) of the cached AIPs' metadata files.
+        """
+        self._aips = OrderedDict()
+        self._sizes = {}
+        self._keys = {}
+        self._maxentries = maxentries
+        self._maxbytes = maxbytes
+        self._bytes = 0
+        self._pins = {}
+        self._retired = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(path: str) -> tuple:
+        """Return the cache key for the given AIP .tar file.
+
+        :param path: The path to the .tar file.
+        :return: A tuple of the file's absolute path, size and mtime.
+        """
+        stat = os.stat(path)
+        return os.path.abspath(path), stat.st_size, stat.st_mtime
+
+    def get(self, key: tuple) -> "AIP | None":
+        """Return the cached AIP for the given key and mark it as most recently used.
+
+        :param key: A key created by AIPCache.key().
+        :return: The AIP object or None, if no AIP is cached for the key.
+        """
+        with self._lock:
+            aip = self._aips.get(key)
+            if aip is not None:
+                self._aips.move_to_end(key)
+            return aip
+
+    def put(self, key: tuple, aip: "AIP", keep: set[tuple] = None) -> "AIP":
+        """Cache the given AIP and evict the least recently used AIPs, if the cache is full.
+
+        If another request has cached an AIP for the same key in the meantime, the cached AIP
+        is kept (and the given one discarded), unless only the given AIP has parsed its .tar
+        file. An AIP cached for an older version of the same .tar file is replaced right away,
+        unless it is pinned by a running request. Then it is evicted, when it is unpinned.
+
+        :param key: A key created by AIPCache.key().
+        :param aip: The successfully parsed AIP object.
+        :param keep: Keys of AIPs, that must not be evicted (in addition to the pinned ones).
+        :return: The AIP now cached for the key, which is to be used instead of the given one.
+        """
+        keep = keep or set()
+        with self._lock:
+            cached = self._aips.get(key)
+            if cached is aip:
+                return aip
+            if cached is not None:
+                if cached.isloaded() or not aip.isloaded():
+                    aip.cleanup()
+                    return cached
+                self._evict(key)
+            old = self._keys.get(key[0])
+            if old is not None and old != key and old not in keep and old not in self._pins:
+                self._evict(old)
+
+            self._aips[key] = aip
+            self._sizes[key] = os.path.getsize(aip.getmetadata()) if aip.getmetadata() else 0
+            self._keys[key[0]] = key
+            self._bytes += self._sizes[key]
+            self.trim(keep | {key})
+            return aip
+
+    def trim(self, keep: set[tuple] = None):
+        """Evict the least recently used AIPs until the cache is within its limits again.
+
+        :param keep: Keys of AIPs, that must not be evicted (in addition to the pinned ones).
+        """
+        keep = keep or set()
+        with self._lock:
+            for k in list(self._aips):
+                if len(self._aips) <= self._maxentries and self._bytes <= self._maxbytes:
+                    break
+                if k not in keep and k not in self._pins:
+                    self._evict(k)
+
+    def pin(self, key: tuple):
+        """Protect the AIP with the given key from eviction, until it is unpinned again.
+
+        A key can be pinned by several requests at once, and can be pinned before an AIP is cached for it.
+
+        :param key: A key created by AIPCache.key().
+        """
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def unpin(self, keys: list[tuple] | set[tuple]):
+        """Release one pin of each of the given keys.
+
+        The temporary files of AIPs, that were replaced in the cache while being pinned, are deleted,
+        as soon as their key isn't pinned anymore. AIPs of outdated .tar files and AIPs, that were kept
+        beyond the cache's limits because they were pinned, are evicted.
+
+        :param keys: Keys, that were pinned with AIPCache.pin().
+        """
+        with self._lock:
+            for key in keys:
+                self._pins[key] -= 1
+                if self._pins[key] == 0:
+                    del self._pins[key]
+                    for aip in self._retired.pop(key, []):
+                        aip.cleanup()
+                    if key in self._aips and self._keys.get(key[0]) != key:
+                        self._evict(key)
+            self.trim()
+
+    def _evict(self, key: tuple):
+        """Remove the AIP with the given key from the cache and delete its temporary files.
+
+        The temporary files of a pinned AIP are deleted, when it is unpinned.
+
+        :param key: A key created by AIPCache.key().
+        """
+        aip = self._aips.pop(key)
+        self._bytes -= self._sizes.pop(key)
+        if self._keys.get(key[0]) == key:
+            del self._keys[key[0]]
+        if key in self._pins:
+            self._retired.setdefault(key, []).append(aip)
+        else:
+            aip.cleanup()
+
+    def __contains__(self, key: tuple) -> bool:
+        with self._lock:
+            return key in self._aips
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._aips)
+
+
+class XsltCache:
+    """Cache of compiled XSLT stylesheets.
+
+    Each stylesheet is compiled only once and reused for all transformations, until its
+    .xsl file is modified. As a SaxonC XSLT processor holds one compiled stylesheet at a
+    time, the cache keeps a processor of its own for each stylesheet.
+
+    The cache can be shared by requests running in different threads. As neither the Saxon
+    processor nor the XSLT processors may be used by several threads at once, all calls into
+    Saxon (compilation and transformation) are serialized by the cache's lock.
+    """
+
+    _proc: PySaxonProcessor
+    _xslts: dict[str, tuple[float, PyXslt30Processor]]
+    _hits: int
+    _misses: int
+    _lock: threading.RLock
+
+    DUMMY = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?><dummy></dummy>'
+
+    def __init__(self, proc: PySaxonProcessor):
+        """Initialize and return an empty XsltCache object.
+
+        :param proc: The Saxon processor used to create the XSLT processors.
+        """
+        self._proc = proc
+        self._xslts = {}
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.RLock()
+
+    def get(self, path: str) -> PyXslt30Processor:
+        """Return an XSLT processor holding the compiled stylesheet of the given .xsl file.
+
+        The stylesheet is compiled, if it isn't cached yet or if the .xsl file has been
+        modified since it was compiled (which is checked via the file's mtime). A stylesheet
+        that fails to compile is not cached.
+
+        :param path: The path to the .xsl file.
+        :return: The XSLT processor.
+        :raises RuntimeError: If the stylesheet could not be compiled.
+        """
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            cached = self._xslts.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._hits += 1
+                return cached[1]
+
+            self._misses += 1
+            if cached is not None:
+                cached[1].release_stylesheet()
+                del self._xslts[path]
+            xsltproc = self._proc.new_xslt30_processor()
+            xsltproc.compile_stylesheet(stylesheet_file=path)
+            self._check(xsltproc, "Compiling " + path)
+            self._xslts[path] = (mtime, xsltproc)
+            return xsltproc
+
+    def transform(self, path: str, output: str, params: dict[str, str | list[str | bytes]] = None):
+        """Run the compiled stylesheet of the given .xsl file and write the result to the given path.
+
+        The transformation is fed entirely from memory: The stylesheet is applied to an empty
+        dummy document and receives its input through stylesheet parameters. A parameter with
+        a string value is passed as xs:string, a parameter with a list of .xml documents (given
+        as file paths or as serialized bytes) is passed as sequence of the parsed documents
+        (in the order of the list).
+
+        :param path: The path to the .xsl file.
+        :param output: The path, to which the result shall be written.
+        :param params: The stylesheet parameters (optional).
+        :raises RuntimeError: If a document could not be parsed or the transformation failed.
+        """
+        with self._lock:
+            xsltproc = self.get(path)
+            # Cleared in any case, as the processor (with its parameters) is shared by all requests
+            try:
+                for name, value in (params or {}).items():
+                    if isinstance(value, str):
+                        xsltproc.set_parameter(name, self._proc.make_string_value(value))
+                    else:
+                        docs = PyXdmValue()
+                        for n, doc in enumerate(value):
+                            if isinstance(doc, bytes):
+                                node = self._proc.parse_xml(xml_text=doc.decode("UTF-8"))
+                            else:
+                                node = self._proc.parse_xml(xml_file_name=doc)
+                            if node is None:
+                                raise RuntimeError("Parsing document " + (doc if isinstance(doc, str) else str(n))
+                                                   + " of parameter " + name + " failed")
+                            docs.add_xdm_item(node)
+                        xsltproc.set_parameter(name, docs)
+                xsltproc.transform_to_file(xdm_node=self._proc.parse_xml(xml_text=self.DUMMY), output_file=output)
+                self._check(xsltproc, "Transformation with " + path)
+            finally:
+                xsltproc.clear_parameters()
+
+    @staticmethod
+    def _check(xsltproc: PyXslt30Processor, what: str):
+        """Raise the errors SaxonC reported for the last call of the given XSLT processor.
+
+        SaxonC doesn't raise its errors as Python exceptions, they have to be polled after each
+        call. The errors are cleared, so that they aren't reported again by the next call.
+
+        :param xsltproc: The XSLT processor.
+        :param what: A description of the failed call for the error message.
+        :raises RuntimeError: If an error occurred.
+        """
+        if not xsltproc.exception_occurred():
+            return
+        messages = [xsltproc.get_error_message(i) for i in range(xsltproc.exception_count())]
+        xsltproc.exception_clear()
+        raise RuntimeError(what + " failed: " + "; ".join(m for m in messages if m))
+
+    def gethits(self) -> int:
+        """Return the number of requests that were answered from the cache."""
+        return self._hits
+
+    def getmisses(self) -> int:
+        """Return the number of requests that caused a stylesheet to be compiled."""
+        return self._misses
@@ -1,12 +1,22 @@
 import os.path
 import gc
 import json
+import logging
+import sqlite3
 import tarfile
 import tempfile
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import BinaryIO, Callable
 from saxonpy import PySaxonProcessor
+from drh.cache import AIPCache, SchemaCache, XsltCache
 from drh.err import *
+from drh.index import AIPIndex
 from drh.ip import AIP, DIP, ViewDIP
+from drh.pack import TarPool
+from drh.progress import Cancelled, CancelToken, Progress
+
+log = logging.getLogger(__name__)
 
 
 class AbstractDrhResponse(ABC):
@@ -97,7 +107,9 @@ class DrhResponse(AbstractDrhResponse):
 class DIPRequestHandler:
     """The main class handling DIP info- or generation-requests."""
 
-    def __init__(self, confdir: str, conf: str, vconfdir: str, vconf: str):
+    def __init__(self, confdir: str, conf: str, vconfdir: str, vconf: str, workers: int = 1,
+                 cachesize: int = 64, cachebytes: int = 512 * 1024 * 1024, indexpath: str = None,
+                 precompile: bool = False):
         """Initialize and return a DIPRequestHandler object.
 
         The params given to this constructor are used throughout the entire
@@ -107,6 +119,13 @@ class DIPRequestHandler:
         :param conf: The path to the main DIP config file (relative to the confdir).
         :param vconfdir: The path to the directory containing the ViewDIP configs.
         :param vconf: The path to the main ViewDIP config file (relative to the vconfdir).
+        :param workers: The number of threads used to parse AIPs concurrently (optional, default: 1 = no concurrency).
+        :param cachesize: The maximum number of parsed AIPs kept in the AIP cache (optional).
+        :param cachebytes: The maximum size (in bytes) of the metadata of all AIPs kept in the AIP cache (optional).
+        :param indexpath: The path to a database file, in which the metadata of parsed AIPs is kept across
+            sessions (optional, default: None = no persistent index).
+        :param precompile: Whether the stylesheets of all profiles shall be compiled right away (optional, default:
+            False = each stylesheet is compiled on its first use).
         """
 
         self._confdir = confdir
@@ -116,10 +135,30 @@ class DIPRequestHandler:
         self._descs = self._loadpdescs()
         self._info = self._loadinfo()
         self._tempdir = tempfile.TemporaryDirectory()
-        self._aips = {}
+        self._aips = AIPCache(cachesize, cachebytes)
+        self._workers = workers
+        self._index = self._openindex(indexpath) if indexpath else None
+        self._schemas = SchemaCache()
         self._proc = PySaxonProcessor(license=False)
         self._proc.set_cwd(os.getcwd())
-        self._xsltproc = self._proc.new_xslt30_processor()
+        self._xslts = XsltCache(self._proc)
+        if precompile:
+            self._compilexsls()
+
+    @staticmethod
+    def _openindex(path: str) -> AIPIndex | None:
+        """Open the AIP index at the given path.
+
+        As the index is only a cache, the handler works without it, if it can't be opened
+        (e.g. because its directory isn't writable).
+
+        :return: The index, or None, if it couldn't be opened.
+        """
+        try:
+            return AIPIndex(path)
+        except (sqlite3.Error, OSError) as e:
+            log.warning("Continuing without the AIP index %s: %s", path, e)
+            return None
 
     def _loadconf(self, dir_: str, conf: str) -> dict:
         """Load and return the given json config file as dictionary.
@@ -150,6 +189,17 @@ class DIPRequestHandler:
                 descs.append(jsondesc)
         return descs
 
+    def _compilexsls(self):
+        """Compile the stylesheets of all profiles and add them to the stylesheet cache.
+
+        The method uses the object's _conf property. It should therefore only be called
+        *after* the config file has been loaded and assigned to the _conf property.
+        """
+
+        for profile in self._conf["profileConfigs"]:
+            if "xsl" in profile:
+                self._xslts.get(os.path.join(self._confdir, profile["xsl"]))
+
     def _loadinfo(self) -> dict:
         """Load and return the general infotexts.
 
@@ -164,7 +214,8 @@ class DIPRequestHandler:
             jsoninfo = json.load(info)
         return jsoninfo
 
-    def startrequest(self, uchoices: dict) -> DrhResponse:
+    def startrequest(self, uchoices: dict, callback: Callable[[dict], None] = None,
+                     token: CancelToken = None) -> DrhResponse:
         """Start and execute a request for a DIP generation.
 
         The dictionary containing the user's choices must have the following keys:
@@ -173,34 +224,177 @@ class DIPRequestHandler:
             * "deliveryType": The chosen deliveryType ("viewer", "download", "both").
             * "outputPath": The path of a directory, to where the (View)DIP shall be saved.
 
+        While the request is running, its progress is passed to the callback (see drh.progress.Progress
+        for the reported phases and keys). The callback is called in the thread running the request.
+        If the token is cancelled, the request stops at the next file (or the next MiB copied), removes
+        the incomplete .tar file and returns a response with a CancelledError. IPs completely saved
+        before the cancellation are kept and listed in the response.
+
         :param uchoices: A dictionary containing the user's choices.
+        :param callback: A function called with each progress report (optional).
+        :param token: A token, with which the request can be cancelled from another thread (optional).
         :return: A response object containing information about successful steps and errors, if any.
         """
 
         resp = DrhResponse()
-        aips, errors = self._parseaip(uchoices["chosenAips"], mode="req")
+        progress = Progress(callback, token)
+        pins = []
+        try:
+            return self._request(uchoices, resp, progress, pins)
+        except Cancelled:
+            resp.newerror(CancelledError(uchoices["outputPath"]))
+            return resp
+        finally:
+            self._aips.unpin(pins)
+
+    def _request(self, uchoices: dict, resp: DrhResponse, progress: Progress, pins: list) -> DrhResponse:
+        """Execute a request for a DIP generation (see startrequest).
+
+        :param uchoices: A dictionary containing the user's choices.
+        :param resp: The response object of the request.
+        :param progress: The Progress object of the request.
+        :param pins: A list, to which the keys of the AIPs pinned in the AIP cache for this request are added.
+        :return: The response object containing information about successful steps and errors, if any.
+        """
+
+        aips, errors = self._parseaip(uchoices["chosenAips"], mode="req", progress=progress, pins=pins)
         if errors is not None and len(errors) > 0:
             resp.newerror(errors)
             return resp
         resp.newsuccess(ip="AIP", type_="parse", detail="Request AIPs")
 
-        if uchoices["profileNo"] == 3:
-            path = os.path.join(uchoices["outputPath"], aips[0].getieid())
-            if os.path.exists(path):
-                resp.newerror(PathExistsError(path))
-                return resp
-            os.mkdir(path)
-            for a in aips:
-                errs = a.save(path)
-                if errs is not None:
-                    resp.newerror(SavingError("AIP", errs))
+        # Source AIP .tar files are opened once and shared by all IPs saved during this request
+        with TarPool() as pool:
+            if uchoices["profileNo"] == 3:
+                path = os.path.join(uchoices["outputPath"], aips[0].getieid())
+                try:
+                    os.mkdir(path)
+                except FileExistsError:
+                    resp.newerror(PathExistsError(path))
                     return resp
-                errs = a.savexsd(path)
-                if errs is not None:
-                    resp.newerror(SavingError("AIP", errs))
+                compression = self._conf["profileConfigs"][3].get("compression")
+                for a in aips:
+                    errs = a.save(path, pool, compression, progress)
+                    if errs is not None:
+                        resp.newerror(SavingError("AIP", errs))
+                        return resp
+                    errs = a.savexsd(path)
+                    if errs is not None:
+                        resp.newerror(SavingError("AIP", errs))
+                        return resp
+                resp.newsuccess(detail=path, ip="AIP", type_="save")
+                return resp
+
+            # Create DIP and, if user chose download as delivery type, save it
+            dip = self._createdip(uchoices, aips, resp, progress)
+            if dip is None:
+                return resp
+            # The DIP's metadata .xml is only needed until the (View)DIP is saved
+            try:
+                if uchoices["deliveryType"] != "viewer":
+                    errs = dip.save(uchoices["outputPath"], pool, progress)
+                    if errs is not None:
+                        resp.newerror(SavingError(dip.getid(), errs))
+                        return resp
+                    resp.newsuccess(detail=dip.getsavedpath(), ip="DIP", type_="save")
+
+                # If user chose Viewer as delivery type, create ViewDIP
+                if uchoices["deliveryType"] != "download":
+                    vdip = self._createvdip(dip, resp, progress)
+                    if vdip is None:
+                        return resp
+                    errs = vdip.save(uchoices["outputPath"], pool, progress)
+                    if errs is not None:
+                        resp.newerror(SavingError(vdip.getid(), errs))
+                        return resp
+                    resp.newsuccess(detail=vdip.getsavedpath(), ip="VDIP", type_="save")
+            finally:
+                dip.cleanup()
+
+        return resp
+
+    def streamrequest(self, uchoices: dict, stream: BinaryIO, callback: Callable[[dict], None] = None,
+                      token: CancelToken = None) -> DrhResponse:
+        """Start and execute a request for a DIP generation, writing the result to a stream instead of a directory.
+
+        The .tar file of the DIP (delivery type "download") resp. of the ViewDIP (delivery type "viewer")
+        is written to the stream while it is assembled (see DIP.write), so its delivery (e.g. through a
+        socket, a pipe or an HTTP response) starts with the first payload file and no local copy is created.
+        The user's choices are the same as for startrequest, except that no "outputPath" is needed. As
+        only one .tar file can be written to a stream, the delivery type "both" and profiles delivering
+        the AIPs themselves are rejected with a StreamError.
+
+        If the request fails or is cancelled after the first bytes have been written, the stream is left
+        incomplete. The caller has to signal this to the receiver (e.g. by closing the connection).
+
+        :param uchoices: A dictionary containing the user's choices.
+        :param stream: The (binary, writable) stream. It needn't be seekable and isn't closed.
+        :param callback: A function called with each progress report (optional).
+        :param token: A token, with which the request can be cancelled from another thread (optional).
+        :return: A response object containing information about successful steps and errors, if any.
+        """
+
+        resp = DrhResponse()
+        if uchoices["profileNo"] == 3 or uchoices["deliveryType"] not in ("download", "viewer"):
+            detail = "profile 3" if uchoices["profileNo"] == 3 else str(uchoices["deliveryType"])
+            resp.newerror(StreamError(detail))
+            return resp
+        progress = Progress(callback, token)
+        pins = []
+        try:
+            return self._stream(uchoices, stream, resp, progress, pins)
+        except Cancelled:
+            resp.newerror(CancelledError("stream"))
+            return resp
+        finally:
+            self._aips.unpin(pins)
+
+    def _stream(self, uchoices: dict, stream: BinaryIO, resp: DrhResponse, progress: Progress,
+                pins: list) -> DrhResponse:
+        """Execute a request for a DIP generation, that is written to a stream (see streamrequest).
+
+        :param uchoices: A dictionary containing the user's choices.
+        :param stream: The (binary, writable) stream.
+        :param resp: The response object of the request.
+        :param progress: The Progress object of the request.
+        :param pins: A list, to which the keys of the AIPs pinned in the AIP cache for this request are added.
+        :return: The response object containing information about successful steps and errors, if any.
+        """
+
+        aips, errors = self._parseaip(uchoices["chosenAips"], mode="req", progress=progress, pins=pins)
+        if errors is not None and len(errors) > 0:
+            resp.newerror(errors)
+            return resp
+        resp.newsuccess(ip="AIP", type_="parse", detail="Request AIPs")
+
+        dip = self._createdip(uchoices, aips, resp, progress)
+        if dip is None:
+            return resp
+        try:
+            ip, type_ = dip, "DIP"
+            if uchoices["deliveryType"] == "viewer":
+                ip, type_ = self._createvdip(dip, resp, progress), "VDIP"
+                if ip is None:
                     return resp
-            resp.newsuccess(detail=path, ip="AIP", type_="save")
+            with TarPool() as pool:
+                errs = ip.write(stream, pool, progress)
+        finally:
+            dip.cleanup()
+        if errs is not None:
+            resp.newerror(SavingError(ip.getid(), errs))
             return resp
+        resp.newsuccess(detail=ip.getid(), ip=type_, type_="save")
+        return resp
+
+    def _createdip(self, uchoices: dict, aips: list[AIP], resp: DrhResponse, progress: Progress) -> DIP | None:
+        """Create the DIP of a request from the given AIPs.
+
+        :param uchoices: A dictionary containing the user's choices.
+        :param aips: The parsed AIPs of the request.
+        :param resp: The response object of the request.
+        :param progress: The Progress object of the request.
+        :return: The DIP, or None, if its creation failed (the error is added to the response).
+        """
 
         pconf = dict(self._conf["profileConfigs"][uchoices["profileNo"]])
         pconf.update({"xsl": os.path.join(self._confdir, pconf["xsl"])})
@@ -214,33 +408,33 @@ class DIPRequestHandler:
             "vzePath": uchoices["vzePath"]
         }
 
-        # Create DIP and, if user chose download as delivery type, save it
-        dip = DIP(req, self._tempdir, self._xsltproc)
+        progress.start("transform", "DIP", 1)
+        dip = DIP(req, self._tempdir, self._xslts)
+        progress.advance(files=1)
         if not dip.initsuccess():
+            dip.cleanup()
             resp.newerror(ParsingError(dip.getid(), dip.gettb()))
-            return resp
+            return None
         resp.newsuccess(ip="DIP", type_="parse", detail=dip.getid())
-        if uchoices["deliveryType"] != "viewer":
-            errs = dip.save(uchoices["outputPath"])
-            if errs is not None:
-                resp.newerror(SavingError(dip.getid(), errs))
-                return resp
-            resp.newsuccess(detail=os.path.join(uchoices["outputPath"], dip.getid()), ip="DIP", type_="save")
+        return dip
 
-        # If user chose Viewer as delivery type, create ViewDIP
-        if uchoices["deliveryType"] != "download":
-            vdip = ViewDIP(dip, self._vconf, self._tempdir, self._xsltproc)
-            if not vdip.initsuccess():
-                resp.newerror(ParsingError(vdip.getid(), vdip.gettb()))
-                return resp
-            resp.newsuccess(ip="VDIP", type_="parse", detail=vdip.getid())
-            errs = vdip.save(uchoices["outputPath"])
-            if errs is not None:
-                resp.newerror(SavingError(vdip.getid(), errs))
-                return resp
-            resp.newsuccess(detail=os.path.join(uchoices["outputPath"], vdip.getid()), ip="VDIP", type_="save")
+    def _createvdip(self, dip: DIP, resp: DrhResponse, progress: Progress) -> ViewDIP | None:
+        """Create the ViewDIP of a request from its DIP.
 
-        return resp
+        :param dip: The DIP of the request.
+        :param resp: The response object of the request.
+        :param progress: The Progress object of the request.
+        :return: The ViewDIP, or None, if its creation failed (the error is added to the response).
+        """
+
+        progress.start("transform", "VDIP", 1)
+        vdip = ViewDIP(dip, self._vconf, self._tempdir, self._xslts)
+        progress.advance(files=1)
+        if not vdip.initsuccess():
+            resp.newerror(ParsingError(vdip.getid(), vdip.gettb()))
+            return None
+        resp.newsuccess(ip="VDIP", type_="parse", detail=vdip.getid())
+        return vdip
 
     def getinfo(self, prop: str) -> dict:
         """Returns the infotext for the given key as dictionary.
@@ -303,6 +497,20 @@ class DIPRequestHandler:
         """Return the message to be displayed with the aip choice for the profile with the given index."""
         return self._descs[no]["repInfo"]
 
+    def getschemastats(self) -> dict:
+        """Return the hit and miss counters of the AIP schema cache as dictionary with the keys "hits" and "misses"."""
+        return {
+            "hits": self._schemas.gethits(),
+            "misses": self._schemas.getmisses()
+        }
+
+    def getxsltstats(self) -> dict:
+        """Return the hit and miss counters of the stylesheet cache as dictionary with the keys "hits" and "misses"."""
+        return {
+            "hits": self._xslts.gethits(),
+            "misses": self._xslts.getmisses()
+        }
+
     def getaipinfo(self, paths: str | list, vze: str = None) -> InfoResponse:
         """Create and return an info dictionary about the given AIPs.
 
@@ -345,9 +553,9 @@ class DIPRequestHandler:
             return resp
 
         aipinfo = []
-        for a in aips:
+        for i, a in enumerate(aips):
             aip = {
-                "n": str(a.getindex()),
+                "n": str(i),
                 "date": a.getdate()[0:10],
                 "formats": set(a.getformats()),
                 "path": a.getpath()
@@ -383,7 +591,8 @@ class DIPRequestHandler:
         })
         return resp
 
-    def _parseaip(self, paths: list | str, vze: str = None, mode: str = "info") -> (list[AIP], list[DrhError]):
+    def _parseaip(self, paths: list | str, vze: str = None, mode: str = "info", progress: Progress = None,
+                  pins: list = None) -> (list[AIP], list[DrhError]):
         """Parse the given AIPs to AIP objects.
 
         The function checks the given paths and files for validity and creates an internal representation of
@@ -394,9 +603,19 @@ class DIPRequestHandler:
         :param paths: A path to a dictionary (as string) containing AIPs or multiple paths (as list) to AIPs.
         :param vze: A path to a .xml file containing information about the corresponding VZE (optional).
         :param mode: "info" for an info request or "req" for a generation request.
+        :param progress: The Progress object of the request, to which the parsed AIPs are reported (optional).
+        :param pins: A list, to which the keys of the returned AIPs are added. These AIPs stay pinned in the
+            AIP cache, until the caller unpins them (optional, default: None = the AIPs are unpinned on return).
         :return: A tuple containing first the AIP objects as list and second any occurring DrhErrors as list.
         """
 
+        if pins is None:
+            pins = []
+            try:
+                return self._parseaip(paths, vze, mode, progress, pins)
+            finally:
+                self._aips.unpin(pins)
+
         errors = []
         ieid = None
         aips = []
@@ -413,34 +632,60 @@ class DIPRequestHandler:
                 errors.append(PathError(paths, fatal=True))
                 return aips, errors
 
+        # Check the given paths and parse all AIPs, that aren't cached yet.
+        checked = []
+        toparse = {}
         for p in paths:
 
             # Check, if file exists
             if not os.path.exists(p):
-                errors.append(PathError(p))
+                checked.append((p, None, PathError(p)))
                 continue
 
             # Check, if file is tar.
             if not tarfile.is_tarfile(p) or os.path.isdir(p):
-                errors.append(FormatError(p))
+                checked.append((p, None, FormatError(p)))
+                continue
+
+            key = AIPCache.key(p)
+            checked.append((p, key, None))
+
+            # AIPs used by this call must not be evicted from the cache (e.g. by concurrent requests)
+            if key not in pins:
+                self._aips.pin(key)
+                pins.append(key)
+            if key not in self._aips or (mode == "req" and not self._aips.get(key).isloaded()):
+                toparse.setdefault(key, p)
+
+        self._aips.trim()
+        parsed = self._newaips(list(toparse.values()), mode, progress)
+
+        keys = []
+        for p, key, error in checked:
+            if error is not None:
+                errors.append(error)
+                continue
+            if key in keys:
                 continue
 
             aipid = os.path.basename(p)
             aipid = aipid[0:-4]
-            if aipid not in self._aips and aipid not in aipids:
-                # Try to create an AIP object.
-                aip = AIP(p, os.path.join(self._confdir, self._conf["AIPschema"]), self._tempdir)
+            if key in toparse:
+                # Take the newly created AIP object.
+                aip = parsed[toparse[key]]
 
                 # Check, if tar is AIP.
                 if not aip.initsuccess():
-                    errors.append(ParsingError(p, aip.gettb()))
+                    errors.append(AIPError(p, tb=aip.gettb()))
                     del aip
                     gc.collect()
                     continue
 
-                self._aips.update({aipid: aip})
+                # Another request may have cached the same AIP meanwhile
+                aip = self._aips.put(key, aip)
             else:
-                aip = self._aips[aipid]
+                aip = self._aips.get(key)
+            keys.append(key)
             aips.append(aip)
             aipids.append(aipid)
 
@@ -467,6 +712,64 @@ class DIPRequestHandler:
         aips = sorted(aips)
         for i in range(len(aips)):
             aips[i].setindex(i)
-            self._aips.update({aipids[i]: aips[i]})
 
         return aips, errors
+
+    def _newaips(self, paths: list[str], mode: str = "info", progress: Progress = None) -> dict[str, AIP]:
+        """Create AIP objects for the given .tar files.
+
+        For an info request, AIPs whose .tar files are unchanged since they were indexed
+        are restored from the AIP index without reading the .tar files. All other AIPs are
+        parsed and, if successful, stored in the index.
+        If the DIPRequestHandler was initialized with more than one worker, the AIPs are
+        parsed concurrently in a thread pool. Otherwise, they are parsed one after another.
+        Each AIP object is returned regardless of whether its parsing was successful.
+        Each parsed AIP is reported to the progress object. If the request is cancelled,
+        AIPs not being parsed yet are skipped and drh.progress.Cancelled is raised.
+
+        :param paths: The paths to the AIP .tar files.
+        :param mode: "info" for an info request or "req" for a generation request.
+        :param progress: The Progress object of the request (optional).
+        :return: A dictionary containing the AIP objects, with their paths as keys.
+        """
+
+        progress = Progress() if progress is None else progress
+        xsd = os.path.join(self._confdir, self._conf["AIPschema"])
+        aips = {}
+        if self._index is not None and mode == "info":
+            for p in paths:
+                try:
+                    record = self._index.lookup(p)
+                except sqlite3.Error as e:
+                    # E.g. "database is locked", if several processes share the index: parse the AIP instead
+                    log.warning("Lookup of %s in the AIP index failed: %s", p, e)
+                    record = None
+                if record is not None:
+                    aips[p] = AIP(p, xsd, self._tempdir, self._schemas, record=record)
+
+        toparse = [p for p in paths if p not in aips]
+        progress.start("parse", "AIP", len(paths), sum(os.path.getsize(p) for p in toparse))
+        progress.advance(files=len(aips))
+        if self._workers <= 1 or len(toparse) <= 1:
+            for p in toparse:
+                aips[p] = AIP(p, xsd, self._tempdir, self._schemas)
+                progress.advance(files=1, bytes_=os.path.getsize(p))
+        else:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                futures = {executor.submit(AIP, p, xsd, self._tempdir, self._schemas): p for p in toparse}
+                try:
+                    for future in as_completed(futures):
+                        aips[futures[future]] = future.result()
+                        progress.advance(files=1, bytes_=os.path.getsize(futures[future]))
+                except Cancelled:
+                    executor.shutdown(cancel_futures=True)
+                    raise
+
+        if self._index is not None:
+            for p in toparse:
+                if aips[p].initsuccess():
+                    try:
+                        self._index.store(p, aips[p].getrecord())
+                    except sqlite3.Error as e:
+                        log.warning("Storing %s in the AIP index failed: %s", p, e)
+        return aips
@@ -28,6 +28,18 @@ class DrhError:
         """Return the error's fatal hint (bool)."""
         return self._fatal
 
+    def todict(self) -> dict:
+        """Return the error as JSON serializable dictionary.
+
+        The dictionary has the keys "error" (the class name), "desc", "detail" and "fatal".
+        """
+        return {
+            "error": self.__class__.__name__,
+            "desc": self._desc,
+            "detail": self._detail,
+            "fatal": self._fatal
+        }
+
 
 class NoPathError(DrhError):
     """Class for a NoPathError.
@@ -111,16 +123,20 @@ class AIPError(DrhError):
     couldn't be read because it isn't a valid AIP.
     """
 
-    def __init__(self, detail: str, fatal: bool = False):
+    def __init__(self, detail: str, fatal: bool = False, tb: str = None):
         """Initialize and return a AIPError object.
 
         :param detail: A hint to what raised the error (normally the IP id)
         :param fatal: Indicates, whether the error was fatal (program stops) or not fatal (program runs on)
+        :param tb: The traceback of the failed parsing, which is appended to the description (optional).
         :type detail: str
         :type fatal: bool
+        :type tb: str
         """
         super().__init__(detail, fatal)
         self._desc = "At least one of the submitted files couldn't be read because it isn't a valid AIP!"
+        if tb:
+            self._desc += "\n" + tb
 
 
 class IEError(DrhError):
@@ -206,3 +222,40 @@ class SavingError(DrhError):
         """
         super().__init__(detail, fatal)
         self._desc = desc
+
+
+class CancelledError(DrhError):
+    """Class for a CancelledError.
+
+    Should be invoked when a request has been cancelled before it was completed.
+    """
+
+    def __init__(self, detail: str, fatal: bool = True):
+        """Initialize and return a CancelledError object.
+
+        :param detail: A hint to what raised the error (normally the IP id)
+        :param fatal: Indicates, whether the error was fatal (program stops) or not fatal (program runs on)
+        :type detail: str
+        :type fatal: bool
+        """
+        super().__init__(detail, fatal)
+        self._desc = "Request cancelled!"
+
+
+class StreamError(DrhError):
+    """Class for a StreamError.
+
+    Should be invoked when a request can't be written to a stream, because it would result in
+    more than one .tar file (delivery type "both" or a profile delivering the AIPs themselves).
+    """
+
+    def __init__(self, detail: str, fatal: bool = True):
+        """Initialize and return a StreamError object.
+
+        :param detail: A hint to what raised the error (normally the IP id)
+        :param fatal: Indicates, whether the error was fatal (program stops) or not fatal (program runs on)
+        :type detail: str
+        :type fatal: bool
+        """
+        super().__init__(detail, fatal)
+        self._desc = "Only a single DIP or ViewDIP can be written to a stream!"
@@ -0,0 +1,76 @@
+"""Module for a persistent index of AIP metadata, that is kept across sessions."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+class AIPIndex:
+    """Persistent on-disk index of the metadata extracted from AIP .tar files.
+
+    The index is stored as SQLite database. Each entry is keyed by the path, size,
+    mtime and header hash of the AIP's .tar file, so that a modified or replaced
+    .tar file is never answered from the index. The stored records are the
+    dictionaries returned by AIP.getrecord().
+    """
+
+    _path: str
+    _con: sqlite3.Connection
+    _lock: threading.Lock
+
+    HASHSIZE = 64 * 1024
+
+    def __init__(self, path: str):
+        """Initialize and return an AIPIndex object.
+
+        The database file (and its directory) is created, if it doesn't exist yet.
+
+        :param path: The path to the SQLite database file.
+        """
+        self._path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._con:
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS aips ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT, record TEXT)")
+
+    def _headerhash(self, path: str) -> str:
+        """Return the SHA-256 hash of the beginning (incl. the first headers) of the given .tar file."""
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read(self.HASHSIZE)).hexdigest()
+
+    def lookup(self, path: str) -> dict | None:
+        """Return the indexed record for the given .tar file.
+
+        :param path: The path to the AIP .tar file.
+        :return: The record as dictionary, or None, if the file isn't indexed or has changed since indexing.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            row = self._con.execute(
+                "SELECT size, mtime, hash, record FROM aips WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime:
+            return None
+        if row[2] != self._headerhash(path):
+            return None
+        return json.loads(row[3])
+
+    def store(self, path: str, record: dict):
+        """Store the record for the given .tar file in the index (replacing any older record).
+
+        :param path: The path to the AIP .tar file.
+        :param record: The record as returned by AIP.getrecord().
+        """
+        stat = os.stat(path)
+        values = (os.path.abspath(path), stat.st_size, stat.st_mtime, self._headerhash(path), json.dumps(record))
+        with self._lock, self._con:
+            self._con.execute("INSERT OR REPLACE INTO aips VALUES (?, ?, ?, ?, ?)", values)
+
+    def close(self):
+        """Close the database connection."""
+        self._con.close()
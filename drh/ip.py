@@ -1,15 +1,18 @@
+import io
 import os
 import shutil
 import json
 import tempfile
 import tarfile
 import traceback
-import xml.etree.cElementTree as ET
 from lxml import etree
 from datetime import datetime
 from abc import ABC, abstractmethod
+from typing import BinaryIO
 
-from saxonpy import PyXslt30Processor
+from drh.cache import SchemaCache, XsltCache
+from drh.pack import Compression, TarPacker, TarPool
+from drh.progress import Progress
 
 
 class AbstractIP(ABC):
@@ -21,6 +24,7 @@ class AbstractIP(ABC):
     _files: list[str]
     _initsuccess: bool
     _tb: str
+    _savedpath: str | None
 
     def __init__(self, temp: tempfile.TemporaryDirectory):
         """Initialize and return an AbstractIP object.
@@ -34,10 +38,15 @@ class AbstractIP(ABC):
         self._files = []
         self._initsuccess = True
         self._tb = ""
+        self._savedpath = None
 
     @abstractmethod
-    def save(self, path):
-        """Save the IP as .tar file to the specified path."""
+    def save(self, path, pool: TarPool = None):
+        """Save the IP as .tar file to the specified path.
+
+        :param path: The path of the directory, in which the .tar file shall be saved.
+        :param pool: A TarPool shared by all IPs saved during the same request (optional).
+        """
         pass
 
     def getid(self) -> str:
@@ -60,6 +69,10 @@ class AbstractIP(ABC):
         """Return the current traceback of parsing- or saving errors in this IP."""
         return self._tb
 
+    def getsavedpath(self) -> str | None:
+        """Return the path of the IP's saved .tar file (incl. the suffix of the compression codec), or None."""
+        return self._savedpath
+
 
 class AIP(AbstractIP):
     """Object representation of an Archival Information Package
@@ -69,6 +82,8 @@ class AIP(AbstractIP):
         * self._parent: The AIP ID of the AIP, from whom the AIP object was derived.
         * self._date: The date, on which the AIP was last modified (= the date of the latest event).
         * self._files: The paths to all files contained in the AIP
+        * self._stems: The paths to all files contained in the AIP without their format suffix.
+        * self._members: The TarInfo objects of all members of the AIP's .tar file, indexed by member name.
         * self._filenames: The original names (incl. format suffix) of all files contained in the AIP.
         * self._formats: The formats of all files contained in the AIP.
         * self._sizes: The sizes (in kb) of all files contained in the AIP.
@@ -85,6 +100,10 @@ class AIP(AbstractIP):
 
     _path: str
     _xsd: str
+    _schemas: SchemaCache
+    _members: dict[str, tarfile.TarInfo]
+    _stems: list[str]
+    _stemset: set[str]
     _index: int
     _parent: str
     _date: str
@@ -95,21 +114,35 @@ class AIP(AbstractIP):
     _itemIDs: list[str]
     _ieid: str
     _ieinfo: dict
+    _loaded: bool
 
-    def __init__(self, path: str, xsd: str, temp: tempfile.TemporaryDirectory):
+    def __init__(self, path: str, xsd: str, temp: tempfile.TemporaryDirectory, schemas: SchemaCache = None,
+                 record: dict = None):
         """Initialize and return an AIP object.
 
+        If a record (as returned by getrecord()) is given, the AIP's metadata is restored
+        from it and the .tar file isn't read at all. Such an AIP can provide information about
+        itself, but it can't be saved or used for DIP generation, before load() was called.
+
         :param path: Path to the .tar file that contains the AIP
         :param xsd: Path to the .xsd file, that describes the schema of the AIP metadata .xml file.
         :param temp: Path to a temporary directory, that the IP can use during parsing/saving.
+        :param schemas: A cache of compiled schemas shared between AIPs (optional).
+        :param record: A record of the AIP's metadata, e.g. taken from an AIPIndex (optional).
         :type path: str
         :type xsd: str
         :type temp: str
+        :type schemas: SchemaCache
+        :type record: dict
         """
         super().__init__(temp)
 
         self._path = path
         self._xsd = xsd
+        self._schemas = schemas if schemas is not None else SchemaCache()
+        self._members = {}
+        self._stems = []
+        self._stemset = set()
         self._index = None
         self._parent = None
         self._date = None
@@ -122,108 +155,167 @@ class AIP(AbstractIP):
 
         self._ieid = None
         self._ieinfo = {}
+        self._loaded = False
 
+        if record is not None:
+            self._restore(record)
+        else:
+            self.load()
+
+    def load(self):
+        """Parse the AIP's .tar file (again), e.g. if the AIP was restored from a record."""
+        self.cleanup()
+        self._metadata = None
+        self._files = []
+        self._stems = []
+        self._members = {}
+        self._filenames = []
+        self._formats = []
+        self._sizes = []
+        self._preslevels = []
+        self._itemIDs = []
+        self._ieinfo = {}
+        self._initsuccess = True
+        self._tb = ""
         self._parse()
+        self._loaded = self._initsuccess
+
+    def _restore(self, record: dict):
+        """Restore the AIP's metadata from the given record.
+
+        :param record: A record as returned by getrecord().
+        """
+        self._ipid = record["ipid"]
+        self._ieid = record["ieid"]
+        self._parent = record["parent"]
+        self._date = record["date"]
+        self._files = record["files"]
+        self._stems = [os.path.splitext(f)[0] for f in self._files]
+        self._stemset = set(self._stems)
+        self._filenames = record["filenames"]
+        self._formats = record["formats"]
+        self._sizes = record["sizes"]
+        self._preslevels = record["preslevels"]
+        self._itemIDs = record["itemIDs"]
+        self._ieinfo = record["ieinfo"]
 
     def _parse(self):
         """Read the AIP .tar file and parse it as an AIP object.
 
         The function uses the _path property of the object to find the original
-        .tar file, unpacks it (with tarfile) and reads its metadata .xml (with etree).
+        .tar file, reads its metadata .xml into memory (with tarfile) and parses it (with etree).
+        The headers of the .tar file are walked only once: the TarInfo of each member
+        (incl. its header and data offsets) is kept in the _members index, so that later
+        saving/extracting can seek to any member without scanning the archive again.
         If the parsing is successful, the objects _initsuccess is set to True.
         Otherwise, it is set to False and the traceback of any occurring error is
         saved in the objects _traceback property.
         """
 
         try:
+            metadata = None
             with tarfile.open(self._path) as tar:
-                files = tar.getmembers()
-                for f in files:
+                for f in tar.getmembers():
+                    self._members[f.name] = f
                     if f.name == "DIPSARCH.xml":
-                        tar.extractall(path=self._temp.name, members=[f])
-                        self._metadata = os.path.join(self._temp.name, "DIPSARCH.xml")
+                        metadata = tar.extractfile(f).read()
                     else:
                         self._files.append(f.name)
-            if not self._metadata:
+                        self._stems.append(os.path.splitext(f.name)[0])
+            self._stemset = set(self._stems)
+            if metadata is None:
                 self._tb = "No metadata file (DIPSARCH.xml) found!"
                 self._initsuccess = False
                 return
 
-            if not self._validateAIP():
+            # The metadata .xml is read into memory and parsed once. The tree is shared by
+            # validation and extraction and released afterwards.
+            dipsarch = etree.parse(io.BytesIO(metadata))
+            if not self._validateAIP(dipsarch):
                 self._initsuccess = False
                 return
 
-            self._extractmetadata()
-            os.rename(self._metadata, os.path.join(self._temp.name, str(self.ipid) + ".xml"))
-            self._metadata = os.path.join(self._temp.name, str(self.ipid) + ".xml")
+            self._extractmetadata(dipsarch)
+            del dipsarch
+
+            # Only a successfully parsed AIP writes its metadata .xml to a file of its own,
+            # so that AIPs can be parsed concurrently and failed parses leave no files behind.
+            fd, self._metadata = tempfile.mkstemp(prefix=str(self._ipid) + ".", suffix=".xml", dir=self._temp.name)
+            with os.fdopen(fd, "wb") as f:
+                f.write(metadata)
         except Exception as e:
             print("".join(traceback.format_exception(e, limit=10)))
             self._tb += "".join(traceback.format_exception(e, limit=10))
             self._initsuccess = False
 
-    def _validateAIP(self):
+    def _validateAIP(self, dipsarch: etree._ElementTree):
         """Check, whether the AIP's metadata .xml represents a valid AIP XML file
         according to the schema definition file located at the path stored in
-        the _xsd property.
+        the _xsd property. The compiled schema is taken from the _schemas cache.
 
+        :param dipsarch: The parsed metadata .xml of the AIP.
         :return: True, if the validation is successful. Otherwise, None.
         """
         # Note: This method doesn't use the SaxonC processor, because the free
         # SaxonC Home Edition (HE) doesn't support xsd validation.
-        xmlschema_doc = etree.parse(self._xsd)
-        xmlschema = etree.XMLSchema(xmlschema_doc)
+        xmlschema = self._schemas.get(self._xsd)
 
-        xml_doc = etree.parse(self._metadata)
-        if not xmlschema.validate(xml_doc):
+        if not xmlschema.validate(dipsarch):
             self._tb += "AIP DIPSARCH.xml is invalid!"
             return False
 
         ns = "{http://dips.bundesarchiv.de/schema}"
-        dipsarch = ET.parse(self._metadata)
         metafiles = dipsarch.findall(
                 "./" + ns + "intellectualEntity//" + ns + "linkingObjectIdentifier/" +
                 ns + "linkingObjectIdentifierValue")
-        for m in metafiles:
-            if not any(os.path.splitext(f)[0] == m.text for f in self._files):
-                self._tb += "AIP is incomplete! Object " + m.text +\
-                            " is mentioned in DIPSARCH.xml but not present as file."
-                return False
+        missing = [m.text for m in metafiles if m.text not in self._stemset]
+        if missing:
+            self._tb += "AIP is incomplete! The following objects are mentioned in DIPSARCH.xml " \
+                        "but not present as file: " + ", ".join(missing)
+            return False
 
         return True
 
-    def _extractmetadata(self):
+    def _extractmetadata(self, dipsarch: etree._ElementTree):
         """Extract relevant metadata from the AIP's metadata .xml.
 
         The function extracts the information needed during any DIP generation (with etree)
         and saves the data as object properties (see class documentation for a list of
         the metadata stored).
+
+        :param dipsarch: The parsed metadata .xml of the AIP.
         """
         # Note: This method doesn't use the SaxonC processor, because the free
         # SaxonC Home Edition (HE) doesn't support namespace declaration and can
         # therefore not be used to parse the namespaced DIPSARCH.xml
         ns = "{http://dips.bundesarchiv.de/schema}"
-        dipsarch = ET.parse(self._metadata)
 
         parent = dipsarch.find("./" + ns + "AIP/" + ns + "Parent")
         if parent is not None:
             self._parent = parent.text
-        self.ipid = dipsarch.find("./" + ns + "AIP/" + ns + "AIPID").text
+        self._ipid = dipsarch.find("./" + ns + "AIP/" + ns + "AIPID").text
         self._ieid = dipsarch.find("./" + ns + "intellectualEntity/" + ns + "IEID").text
 
-        for f in self._files:
-            ident = os.path.splitext(f)[0]
-
+        # Index items and technical objects by their identifier values in a single pass,
+        # so that each file's metadata can be looked up directly (first occurrence wins).
+        items = {}
+        for v in dipsarch.iterfind(
+                "./" + ns + "intellectualEntity//" + ns + "linkingObjectIdentifier/" +
+                ns + "linkingObjectIdentifierValue"):
+            items.setdefault(v.text, v.getparent().getparent())
+        objects = {}
+        for v in dipsarch.iterfind(
+                "./" + ns + "technical/" + ns + "object/" + ns + "objectIdentifier/" + ns + "objectIdentifierValue"):
+            objects.setdefault(v.text, v.getparent().getparent())
+
+        for ident in self._stems:
             # Extract filename and item ID
-            item = dipsarch.find(
-                "./" + ns + "intellectualEntity//" + ns + "linkingObjectIdentifier[" +
-                ns + "linkingObjectIdentifierValue='" + ident + "']/..")
+            item = items[ident]
             self._filenames.append(item.find("./" + ns + "title").text)
             self._itemIDs.append(item.find("./" + ns + "IID").text)
 
             # Extract file format, file size and preservation level
-            item = dipsarch.find(
-                "./" + ns + "technical/" + ns + "object/" + ns
-                + "objectIdentifier[" + ns + "objectIdentifierValue='" + ident + "']/..")
+            item = objects[ident]
             self._formats.append(item.find(".//" + ns + "formatName").text)
             self._sizes.append(item.find(".//" + ns + "size").text)
             self._preslevels.append(item.find("./" + ns + "preservationLevel").text)
@@ -249,24 +341,64 @@ class AIP(AbstractIP):
             "type": dipsarch.find("./" + ns + "intellectualEntity/" + ns + "type").text
         })
 
-    def save(self, path: str) -> str | None:
+    def save(self, path: str, pool: TarPool = None, compression: dict = None,
+             progress: Progress = None) -> str | None:
         """Save the AIP to the given path as .tar file.
 
+        If the request is cancelled (see drh.progress), the incomplete .tar file is removed and
+        drh.progress.Cancelled is raised.
+
+        :param path: The path of the directory, in which the .tar file shall be saved.
+        :param pool: A TarPool shared by all IPs saved during the same request (optional).
+        :param compression: The "compression" object of the profile config (optional, default: None = no compression).
+        :param progress: The Progress object of the request (optional).
         :return: None, if saving was successful. A string with the error traceback, if it wasn't.
         """
+        progress = Progress() if progress is None else progress
         try:
-            with tarfile.open(self._path, "r") as tar:
-                for fname in self._files:
-                    tar.extractall(path=self._temp.name, members=[tar.getmember(fname)])
-
-            with tarfile.open(os.path.join(path, self.ipid + ".tar"), "x") as tar:
-                for fname in self._files:
-                    tar.add(os.path.join(self._temp.name, fname), arcname=fname)
-                tar.add(self._metadata, arcname="DIPSARCH.xml")
+            members = [self._members[fname] for fname in self._files]
+            compression = Compression(compression).resolve(members)
+            progress.start("pack", "AIP", len(members), sum(m.size for m in members))
+            with TarPacker(os.path.join(path, self._ipid + ".tar"), pool, compression=compression,
+                           progress=progress) as packer:
+                packer.addmembers(self._path, members)
+                progress.start("write", "AIP", 1)
+                packer.addpath(self._metadata, arcname="DIPSARCH.xml")
+            self._savedpath = packer.getpath()
+            progress.advance(files=1)
 
         except Exception as e:
             return "".join(traceback.format_exception(e, limit=10))
 
+    def getrecord(self) -> dict:
+        """Return the metadata extracted from the AIP as JSON serializable dictionary.
+
+        The record can be stored (e.g. in an AIPIndex) and passed to the constructor
+        later on, to restore the AIP without parsing its .tar file again.
+        """
+        return {
+            "ipid": self._ipid,
+            "ieid": self._ieid,
+            "parent": self._parent,
+            "date": self._date,
+            "files": self._files,
+            "filenames": self._filenames,
+            "formats": self._formats,
+            "sizes": self._sizes,
+            "preslevels": self._preslevels,
+            "itemIDs": self._itemIDs,
+            "ieinfo": self._ieinfo
+        }
+
+    def isloaded(self) -> bool:
+        """Return, whether the AIP's .tar file has been parsed (True) or the AIP was only restored from a record."""
+        return self._loaded
+
+    def cleanup(self):
+        """Delete the temporary files of the AIP (i.e. its metadata .xml)."""
+        if self._metadata and os.path.exists(self._metadata):
+            os.remove(self._metadata)
+
     def savexsd(self, path: str) -> str | None:
         """Save the AIP's xsd to the given path.
 
@@ -277,6 +409,16 @@ class AIP(AbstractIP):
         except Exception as e:
             return "".join(traceback.format_exception(e, limit=10))
 
+    def getmember(self, name: str) -> tarfile.TarInfo:
+        """Return the TarInfo of the member with the given name from the AIP's member index.
+
+        The TarInfo is taken from the index built during parsing and can be passed to any
+        TarFile opened on the AIP's .tar file without the archive's headers being scanned again.
+
+        :param name: The name of the member inside the AIP's .tar file.
+        """
+        return self._members[name]
+
     def getfilenames(self) -> list[str]:
         """Return the filenames of the files contained in the AIP as list of strings."""
         return self._filenames
@@ -348,17 +490,16 @@ class DIP(AbstractIP):
         * self._ipid: The generated ID of the DIP.
         * self._date: The datetime of the DIP's creation.
         * self._aips: The AIP objects, that are contained in the DIP.
-        * self._files: The paths to all files contained in the DIP.
-        * self._origAIPs: The AIP('s), each file is contained in.
+        * self._origAIPs: The paths to all files contained in the DIP, each mapped to the AIP it is taken from.
     """
 
     _conf: dict
     _date: str
-    _origAIPs: list[list[AIP]]
+    _origAIPs: dict[str, AIP]
     _aips = list[AIP]
-    _xsltproc: PyXslt30Processor
+    _xslts: XsltCache
 
-    def __init__(self, req: dict, temp: tempfile.TemporaryDirectory, xsltproc: PyXslt30Processor):
+    def __init__(self, req: dict, temp: tempfile.TemporaryDirectory, xslts: XsltCache):
         """Initialize and return a DIP object.
 
         The req dictionary must have the following keys:
@@ -370,13 +511,19 @@ class DIP(AbstractIP):
                 * "generatorName": Name of the generation algorithm used to generate the DIP.
                 * "generatorVersion": Version of the generation algorithm used to generate the DIP.
                 * "issuedBy": Identifier of the institution that issues the DIP.
+                * "compression" (optional): The compression of the DIP's .tar file, as object with the keys "codec"
+                  ("none", "gzip", "bz2", "xz" or "auto") and "level" (optional).
+                * "deduplicate" (optional): Whether payload files with identical content shall be stored only once
+                  in the .tar file (further occurrences are stored as hardlinks).
+                * "prune" (optional): Paths of elements (relative to the root element of the AIP metadata), that
+                  the stylesheet never reads. These elements are dropped while the AIP metadata is read.
             * "vzePath": A path to an .xml file containing information about the VZE, or None.
         :param req: The request settings and user choices as dictionary.
         :param temp: Path to a temporary directory, that the IP can use during parsing/saving.
-        :param xsltproc: The Saxon XSLT Processor for the transformation of the metadata .xml file.
+        :param xslts: The cache of compiled stylesheets for the transformation of the metadata .xml file.
         :type req: dict
         :type temp: str
-        :type xsltproc: PyXslt30Processor
+        :type xslts: XsltCache
         """
 
         super().__init__(temp)
@@ -388,31 +535,21 @@ class DIP(AbstractIP):
                      + "-v" + self._conf["profileMetadata"]["profileVersion"] \
                      + "." + req["aips"][0].getieid() \
                      + "." + self._date
-        self._origAIPs = []
+        self._origAIPs = {}
         self._aips = req["aips"]
 
-        self._xsltproc = xsltproc
+        self._xslts = xslts
         self._filterfiles(self._aips)
         self._transformmetadata()
-        self._initsuccess = True
 
     def _filterfiles(self, aips):
         for a in aips:
-            afiles = a.getfiles()
-            for i in range(0, len(afiles)):
-                if not afiles[i] in self._files:
-                    self._files.append(afiles[i])
-                    self._origAIPs.append(a)
+            for f in a.getfiles():
+                self._origAIPs.setdefault(f, a)
 
     def _transformmetadata(self):
         try:
-            # Create new tempfolder and copy xsl to it, create dummy xml
-            temp = tempfile.TemporaryDirectory()
-            shutil.copy2(self._conf["xsl"], os.path.join(temp.name, "xsl.xsl"))
-            with open(os.path.join(temp.name, "dummy.xml"), "w") as f:
-                f.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?><dummy></dummy>')
-
-            # Create config json in folder
+            # Pass the DIP's variables and the AIPs' metadata (ordered by index) as stylesheet params
             vars_ = {
                 "id": self._ipid,
                 "profileNumber": self.getpno(),
@@ -425,46 +562,96 @@ class DIP(AbstractIP):
                 "type": "UNIVERSAL",
                 "schema": "DIP-P" + str(self.getpno()) + ".xsd"
             }
-            with open(os.path.join(temp.name, "vars.json"), "w") as jf:
-                json.dump(vars_, jf)
-
-            # Copy aip metadata to shared folder (while renaming according to index)
-            aipdir = os.path.join(temp.name, "aips")
-            os.mkdir(aipdir)
-            for a in self._aips:
-                aipname = ""
-                for j in range(0, 4-len(str(a.getindex()))):
-                    aipname += "0"
-                aipname += str(a.getindex())
-                shutil.copy2(a.getmetadata(), os.path.join(aipdir, aipname + ".xml"))
-
-            self._metadata = os.path.join(self._temp.name, self._ipid + ".xml")
-
-            # Start transformation
-            self._xsltproc.transform_to_file(
-                source_file=os.path.join(temp.name, "dummy.xml"),
-                output_file=self._metadata,
-                stylesheet_file=os.path.join(temp.name, "xsl.xsl"))
+            # Sorted by date (like the AIP indexes), as concurrent requests may index the shared AIPs differently
+            aips = [a.getmetadata() for a in sorted(self._aips)]
+            if self._conf.get("prune"):
+                aips = [self._prunemetadata(a, self._conf["prune"]) for a in aips]
+            params = {
+                "vars": json.dumps(vars_),
+                "aips": aips
+            }
+
+            # A unique name, as concurrent requests may create DIPs with the same ID
+            fd, self._metadata = tempfile.mkstemp(prefix=self._ipid + ".", suffix=".xml", dir=self._temp.name)
+            os.close(fd)
+
+            # Start transformation with the profile's compiled stylesheet
+            self._xslts.transform(self._conf["xsl"], self._metadata, params)
 
         except Exception as e:
             self._tb += "".join(traceback.format_exception(e, limit=10))
             self._initsuccess = False
 
-    def save(self, path) -> None | str:
+    @staticmethod
+    def _prunemetadata(path: str, prune: list[str]) -> bytes:
+        """Read the given AIP metadata .xml file without the given elements and return the remaining document.
+
+        The file is read incrementally and each pruned element is discarded as soon as it
+        has been read, so that large sections (e.g. the event logs in the technical metadata)
+        never have to be held in memory as a whole.
+
+        :param path: The path to the AIP metadata .xml file.
+        :param prune: Paths of element (local) names, relative to the root element (e.g. "technical/event").
+        :return: The pruned document as serialized .xml.
+        """
+        prune = {tuple(p.strip("/").split("/")) for p in prune}
+        root = None
+        names = []
+        for event, elem in etree.iterparse(path, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                else:
+                    names.append(etree.QName(elem).localname)
+            elif elem is not root:
+                if tuple(names) in prune:
+                    elem.getparent().remove(elem)
+                names.pop()
+        return etree.tostring(root.getroottree(), xml_declaration=True, encoding="UTF-8")
+
+    def save(self, path, pool: TarPool = None, progress: Progress = None) -> None | str:
         """Save the DIP to the given path as .tar file.
 
+        If the request is cancelled (see drh.progress), the incomplete .tar file is removed and
+        drh.progress.Cancelled is raised.
+
+        :param path: The path of the directory, in which the .tar file shall be saved.
+        :param pool: A TarPool shared by all IPs saved during the same request (optional).
+        :param progress: The Progress object of the request (optional).
         :return: None, if saving was successful. A string with the error traceback, if it wasn't.
         """
-        try:
-            for i in range(0, len(self._files)):
-                with tarfile.open(self._origAIPs[i].getpath(), "r") as tar:
-                    tar.extractall(path=self._temp.name, members=[tar.getmember(self._files[i])])
+        return self._pack(os.path.join(path, "DIP." + self._ipid + ".tar"), pool, progress)
+
+    def write(self, stream: BinaryIO, pool: TarPool = None, progress: Progress = None) -> None | str:
+        """Write the DIP as .tar file to the given stream (e.g. a socket, a pipe or an HTTP response).
 
-            with tarfile.open(os.path.join(path, "DIP." + self._ipid + ".tar"), "x") as tar:
-                for fname in self._files:
-                    tar.add(os.path.join(self._temp.name, fname), arcname=fname)
-                tar.add(self._metadata, arcname="DIP-Metadata.xml")
-                tar.add(self.getxsd(), arcname="DIP-P" + str(self.getpno()) + ".xsd")
+        The .tar file is written while it is assembled, so no local copy is created. If writing fails
+        or the request is cancelled, the stream is left incomplete (see TarPacker.abort).
+
+        :param stream: The (binary, writable) stream. It needn't be seekable and isn't closed.
+        :param pool: A TarPool shared by all IPs saved during the same request (optional).
+        :param progress: The Progress object of the request (optional).
+        :return: None, if writing was successful. A string with the error traceback, if it wasn't.
+        """
+        return self._pack(stream, pool, progress)
+
+    def _pack(self, target: str | BinaryIO, pool: TarPool, progress: Progress | None) -> None | str:
+        """Write the DIP's .tar file to the given path (without the codec's suffix) or stream (see save and write)."""
+        progress = Progress() if progress is None else progress
+        try:
+            dedup = self._conf.get("deduplicate", False)
+            membersbyaip = self.getmembersbyaip()
+            payload = [m for members in membersbyaip.values() for m in members]
+            compression = Compression(self._conf.get("compression")).resolve(payload)
+            progress.start("pack", "DIP", len(payload), sum(m.size for m in payload))
+            with TarPacker(target, pool, dedup, compression, progress) as packer:
+                for src, members in membersbyaip.items():
+                    packer.addmembers(src, members)
+                progress.start("write", "DIP", 2)
+                packer.addpath(self._metadata, arcname="DIP-Metadata.xml")
+                packer.addpath(self.getxsd(), arcname="DIP-P" + str(self.getpno()) + ".xsd")
+            self._savedpath = packer.getpath()
+            progress.advance(files=2)
 
         except Exception as e:
             return "".join(traceback.format_exception(e, limit=10))
@@ -473,6 +660,15 @@ class DIP(AbstractIP):
         """Return the path to the DIP's metadata .xml as string."""
         return self._metadata
 
+    def cleanup(self):
+        """Delete the temporary files of the DIP (i.e. its metadata .xml, which its ViewDIP shares)."""
+        if self._metadata and os.path.exists(self._metadata):
+            os.remove(self._metadata)
+
+    def getconf(self) -> dict:
+        """Return the config of the DIP's profile as dictionary."""
+        return self._conf
+
     def getpno(self) -> int:
         """Return the index number of the DIP's profile as int."""
         return self._conf["profileMetadata"]["profileNumber"]
@@ -481,8 +677,19 @@ class DIP(AbstractIP):
         """Return the path to the DIP's .xsd schema as string."""
         return self._conf["xsd"]
 
-    def getorigaips(self) -> list[list[AIP]]:
-        """Return the original AIPs of the files contained in the DIP as list of lists of AIPobjects."""
+    def getfiles(self) -> list[str]:
+        """Return the paths of all files contained in the DIP as list (in the order they were first found in)."""
+        return list(self._origAIPs)
+
+    def getmembersbyaip(self) -> dict[str, list[tarfile.TarInfo]]:
+        """Return the TarInfos of the files contained in the DIP, grouped by the path of their original AIP."""
+        members = {}
+        for f, a in self._origAIPs.items():
+            members.setdefault(a.getpath(), []).append(a.getmember(f))
+        return members
+
+    def getorigaips(self) -> dict[str, AIP]:
+        """Return the files contained in the DIP as dictionary, that maps each file's path to its original AIP."""
         return self._origAIPs
 
 
@@ -497,17 +704,17 @@ class ViewDIP(AbstractIP):
         * self._origAIPs: The AIP('s), each file is contained in.
     """
 
-    def __init__(self, dip, conf, temp: tempfile.TemporaryDirectory, xsltproc):
+    def __init__(self, dip, conf, temp: tempfile.TemporaryDirectory, xslts):
         """Initialize and return a ViewDIP object.
 
         :param dip: The DIP object, from which the ViewDIP will be derived.
         :param conf: The ViewDIP config.
         :param temp: Path to a temporary directory, that the IP can use during parsing/saving.
-        :param xsltproc: The Saxon XSLT Processor for the transformation of the metadata .xml file.
+        :param xslts: The cache of compiled stylesheets for the transformation of the metadata .xml file.
         :type dip: DIP
         :type conf: dict
         :type temp: str
-        :type xsltproc: PyXslt30Processor
+        :type xslts: XsltCache
         """
         super().__init__(temp)
 
@@ -518,7 +725,7 @@ class ViewDIP(AbstractIP):
         self._files = dip.getfiles()
         self._origAIPs = dip.getorigaips()
 
-        self._xsltproc = xsltproc
+        self._xslts = xslts
         self._transformmetadata()
 
     def _transformmetadata(self):  # Todo: Implement transformation with saxon
@@ -528,24 +735,48 @@ class ViewDIP(AbstractIP):
             self._tb += "".join(traceback.format_exception(e, limit=10))
             self._initsuccess = False
 
-    def save(self, path):
+    def save(self, path, pool: TarPool = None, progress: Progress = None):
         """Save the ViewDIP to the given path as .tar file.
 
+        If the request is cancelled (see drh.progress), the incomplete .tar file is removed and
+        drh.progress.Cancelled is raised.
+
+        :param path: The path of the directory, in which the .tar file shall be saved.
+        :param pool: A TarPool shared by all IPs saved during the same request (optional).
+        :param progress: The Progress object of the request (optional).
         :return: None, if saving was successful. A string with the error traceback, if it wasn't.
         """
+        return self._pack(os.path.join(path, "VDIP." + self._ipid + ".tar"), pool, progress)
+
+    def write(self, stream: BinaryIO, pool: TarPool = None, progress: Progress = None) -> None | str:
+        """Write the ViewDIP as .tar file to the given stream (see DIP.write).
+
+        :param stream: The (binary, writable) stream. It needn't be seekable and isn't closed.
+        :param pool: A TarPool shared by all IPs saved during the same request (optional).
+        :param progress: The Progress object of the request (optional).
+        :return: None, if writing was successful. A string with the error traceback, if it wasn't.
+        """
+        return self._pack(stream, pool, progress)
+
+    def _pack(self, target: str | BinaryIO, pool: TarPool, progress: Progress | None) -> None | str:
+        """Write the ViewDIP's .tar file to the given path (without the codec's suffix) or stream."""
+        progress = Progress() if progress is None else progress
         try:
-            for i in range(0, len(self._files)):
-                if not os.path.exists(os.path.join(self._temp.name, self._files[i])):
-                    with tarfile.open(self._origAIPs[i].getpath(), "r") as tar:
-                        tar.extractall(path=self._temp.name, members=[tar.getmember(self._files[i])])
-
-            with tarfile.open(os.path.join(path, "VDIP." + self._ipid + ".tar"), "x") as tar:
-                for fname in self._files:
-                    tar.add(self._temp.name + "\\" + fname, arcname=fname)
-                tar.add(self._dip.getmetadata(), arcname="DIP_Metadata.xml")
-                tar.add(self._metadata, arcname="ViewDIP_Metadata.xml")
-                # tar.add(self.getxsd(), arcname="ViewDIP.xsd")
-                tar.add(self._dip.getxsd(), arcname="DIP-Profile" + str(self._dip.getpno()) + ".xsd")
+            dedup = self._dip.getconf().get("deduplicate", False)
+            membersbyaip = self._dip.getmembersbyaip()
+            payload = [m for members in membersbyaip.values() for m in members]
+            compression = Compression(self._dip.getconf().get("compression")).resolve(payload)
+            progress.start("pack", "VDIP", len(payload), sum(m.size for m in payload))
+            with TarPacker(target, pool, dedup, compression, progress) as packer:
+                for src, members in membersbyaip.items():
+                    packer.addmembers(src, members)
+                progress.start("write", "VDIP", 3)
+                packer.addpath(self._dip.getmetadata(), arcname="DIP_Metadata.xml")
+                packer.addpath(self._metadata, arcname="ViewDIP_Metadata.xml")
+                # packer.addpath(self.getxsd(), arcname="ViewDIP.xsd")
+                packer.addpath(self._dip.getxsd(), arcname="DIP-Profile" + str(self._dip.getpno()) + ".xsd")
+            self._savedpath = packer.getpath()
+            progress.advance(files=3)
 
         except Exception as e:
             return "".join(traceback.format_exception(e, limit=10))
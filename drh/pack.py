@@ -0,0 +1,489 @@
+"""Module for assembling the .tar files of Information Packages."""
+
+import bz2
+import contextlib
+import copy
+import gzip
+import hashlib
+import lzma
+import os
+import tarfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import BinaryIO, Callable
+from drh.progress import Progress
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class TarPool:
+    """Pool of open file handles to source .tar files.
+
+    Each source .tar file is opened only once, no matter how many of its members are
+    copied. A pool can be shared by all IPs that are saved during the same request.
+    """
+
+    _handles: dict[str, BinaryIO]
+
+    def __init__(self):
+        """Initialize and return an empty TarPool object."""
+        self._handles = {}
+
+    def get(self, path: str) -> BinaryIO:
+        """Return the open (binary, read-only) file handle of the given .tar file.
+
+        :param path: The path to the .tar file.
+        """
+        if path not in self._handles:
+            self._handles[path] = open(path, "rb")
+        return self._handles[path]
+
+    def close(self):
+        """Close all file handles of the pool."""
+        for f in self._handles.values():
+            f.close()
+        self._handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class StreamOutput:
+    """Wrapper of a writable stream (e.g. a socket, a pipe or an HTTP response), to which a .tar file is written.
+
+    The wrapper is never closed by the packer, so the stream stays open after the .tar file has
+    been finished. If the packer is aborted, the wrapper is detached from the stream: Nothing
+    written afterwards (e.g. buffered data flushed while closing the .tar file) reaches the stream.
+    """
+
+    _out: BinaryIO | None
+
+    def __init__(self, out: BinaryIO):
+        """Initialize and return a StreamOutput object.
+
+        :param out: The (binary, writable) stream. It needn't be seekable.
+        """
+        self._out = out
+
+    def write(self, data: bytes) -> int:
+        """Write data to the stream (unless detached) and return the number of bytes written."""
+        if self._out is not None:
+            self._out.write(data)
+        return len(data)
+
+    def flush(self):
+        """Flush the stream (unless detached)."""
+        if self._out is not None and hasattr(self._out, "flush"):
+            self._out.flush()
+
+    def detach(self):
+        """Detach the wrapper from the stream, discarding all further writes."""
+        self._out = None
+
+    def close(self):
+        """Do nothing, the stream is closed by its owner."""
+
+
+class ParallelWriter:
+    """Writable stream, that compresses the data written to it in several threads.
+
+    The data is split into blocks of equal size, each of which is compressed on its own
+    into a complete gzip member (resp. bz2 or xz stream). The compressed blocks are written
+    to the output file in their original order. As gzip, bz2 and xz all allow concatenated
+    members/streams, the result is a regular compressed file, that common tools (and the
+    Python modules gzip, bz2, lzma and tarfile) read like a single-threaded compressed file.
+    """
+
+    _out: BinaryIO
+    _compress: Callable[[bytes], bytes]
+    _executor: ThreadPoolExecutor
+    _pending: deque[Future]
+    _buffer: bytearray
+    _blocksize: int
+    _maxpending: int
+    _written: bool
+
+    BLOCKSIZE = 1024 * 1024
+
+    def __init__(self, out: BinaryIO, compress: Callable[[bytes], bytes], threads: int, blocksize: int = BLOCKSIZE):
+        """Initialize and return a ParallelWriter object.
+
+        :param out: The (binary, writable) output file. It is closed together with the writer.
+        :param compress: The function compressing a block into a complete member/stream (e.g. gzip.compress).
+        :param threads: The number of threads compressing blocks concurrently.
+        :param blocksize: The size (in bytes) of the uncompressed blocks (optional).
+        """
+        self._out = out
+        self._compress = compress
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._pending = deque()
+        self._maxpending = 2 * threads
+        self._buffer = bytearray()
+        self._blocksize = blocksize
+        self._written = False
+
+    def _submit(self, block: bytes):
+        """Queue a block for compression and write the compressed blocks, that are next in line."""
+        self._pending.append(self._executor.submit(self._compress, block))
+        self._written = True
+        while len(self._pending) > self._maxpending:
+            self._out.write(self._pending.popleft().result())
+
+    def write(self, data: bytes) -> int:
+        """Write data to the stream and return the number of bytes written."""
+        self._buffer += data
+        while len(self._buffer) >= self._blocksize:
+            self._submit(bytes(self._buffer[:self._blocksize]))
+            del self._buffer[:self._blocksize]
+        return len(data)
+
+    def close(self):
+        """Compress the remaining data, write all compressed blocks and close the output file."""
+        try:
+            if self._buffer or not self._written:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._out.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown()
+            self._out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Compression:
+    """Compression settings for the .tar file of an Information Package.
+
+    The settings are given as "compression" object in a profile config, with the keys
+    "codec" (one of "none", "gzip", "bz2", "xz", "zstd" or "auto"), "level" (optional, the
+    codec's compression level resp. preset) and "threads" (optional, the number of threads
+    compressing the .tar file, default: 1). The codec "auto" compresses with gzip, unless
+    most of the payload (by size) is in formats that are compressed already (e.g. JPEG or
+    PDF), in which case the .tar file is left uncompressed. The codec "zstd" requires the
+    optional package zstandard.
+    """
+
+    _codec: str
+    _level: int | None
+    _threads: int
+
+    CODECS = {"none": ("", ""), "gzip": ("gz", ".gz"), "bz2": ("bz2", ".bz2"), "xz": ("xz", ".xz"),
+              "zstd": (None, ".zst")}
+    COMPRESSED = {".jpg", ".jpeg", ".jp2", ".png", ".gif", ".tif", ".tiff", ".pdf", ".zip", ".gz", ".bz2", ".xz",
+                  ".7z", ".mp3", ".mp4", ".m4a", ".mov", ".avi", ".mkv", ".docx", ".xlsx", ".pptx", ".odt", ".ods"}
+
+    def __init__(self, conf: dict = None):
+        """Initialize and return a Compression object.
+
+        :param conf: The "compression" object of a profile config (optional, default: None = no compression).
+        """
+        conf = conf or {}
+        self._codec = conf.get("codec", "none")
+        self._level = conf.get("level")
+        self._threads = conf.get("threads", 1)
+        if self._codec != "auto" and self._codec not in self.CODECS:
+            raise ValueError("Unknown compression codec: " + str(self._codec))
+
+    def resolve(self, members: list[tarfile.TarInfo]) -> "Compression":
+        """Return the settings to be used for a .tar file with the given payload.
+
+        :param members: The TarInfos of the payload files.
+        :return: The settings themselves, or, if the codec is "auto", settings with the chosen codec.
+        """
+        if self._codec != "auto":
+            return self
+        total = sum(m.size for m in members)
+        compressed = sum(m.size for m in members if os.path.splitext(m.name)[1].lower() in self.COMPRESSED)
+        if total > 0 and compressed * 2 >= total:
+            return Compression({"codec": "none"})
+        return Compression({"codec": "gzip", "level": self._level, "threads": self._threads})
+
+    def getcodec(self) -> str:
+        """Return the name of the codec."""
+        return self._codec
+
+    def getsuffix(self) -> str:
+        """Return the file name suffix of the codec (following ".tar", e.g. ".gz")."""
+        return self.CODECS[self._codec][1]
+
+    def _blockcompressor(self) -> Callable[[bytes], bytes]:
+        """Return a function, that compresses a block into a complete member/stream of the codec."""
+        if self._codec == "gzip":
+            return partial(gzip.compress, compresslevel=9 if self._level is None else self._level, mtime=0)
+        if self._codec == "bz2":
+            return partial(bz2.compress, compresslevel=9 if self._level is None else self._level)
+        return partial(lzma.compress, preset=self._level)
+
+    def _streamcompressor(self, out: StreamOutput) -> BinaryIO | None:
+        """Return a single-threaded compressing stream of the codec, that writes to the given stream.
+
+        :return: The compressing stream, or None for the codec "none".
+        """
+        if self._codec == "gzip":
+            return gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9 if self._level is None else self._level,
+                                 mtime=0)
+        if self._codec == "bz2":
+            return bz2.BZ2File(out, "wb", compresslevel=9 if self._level is None else self._level)
+        if self._codec == "xz":
+            return lzma.LZMAFile(out, "wb", preset=self._level)
+        return None
+
+    def open(self, target: str | StreamOutput) -> tuple[tarfile.TarFile, BinaryIO | None]:
+        """Create a new .tar file at the given path resp. in the given stream, compressed according to the settings.
+
+        If the .tar file is written through a compressing stream (zstd, more than one thread or
+        an output stream), the stream is returned as well. It must be closed after the .tar file
+        has been closed. Into an output stream, the .tar file is written strictly sequentially
+        (tarfile's stream mode), so the output stream needn't be seekable.
+
+        :param target: The path of the .tar file to be created (the file must not exist yet) or the output stream.
+        :return: The opened .tar file and the compressing stream (or None).
+        """
+        if self._codec == "auto":
+            raise ValueError("The codec \"auto\" must be resolved before opening a .tar file")
+        tostream = isinstance(target, StreamOutput)
+        if self._codec == "zstd":
+            if zstandard is None:
+                raise ValueError("The codec \"zstd\" requires the package zstandard")
+            level = 3 if self._level is None else self._level
+            threads = self._threads if self._threads > 1 else 0
+            out = target if tostream else open(target, "xb")
+            stream = zstandard.ZstdCompressor(level=level, threads=threads).stream_writer(out)
+            return tarfile.open(fileobj=stream, mode="w|"), stream
+        if self._codec != "none" and self._threads > 1:
+            out = target if tostream else open(target, "xb")
+            stream = ParallelWriter(out, self._blockcompressor(), self._threads)
+            return tarfile.open(fileobj=stream, mode="w|"), stream
+        if tostream:
+            # tarfile's stream mode ignores compression levels, so the compression is done by a stream of its own
+            stream = self._streamcompressor(target)
+            return tarfile.open(fileobj=target if stream is None else stream, mode="w|"), stream
+
+        mode, suffix = self.CODECS[self._codec]
+        if self._codec == "none" or self._level is None:
+            return tarfile.open(target, "x:" + mode), None
+        if self._codec == "xz":
+            return tarfile.open(target, "x:xz", preset=self._level), None
+        return tarfile.open(target, "x:" + mode, compresslevel=self._level), None
+
+
+class TarPacker:
+    """Writer for the .tar file of an Information Package.
+
+    The .tar file is either created on disk or written to a writable stream (e.g. a socket, a
+    pipe or an HTTP response), without a local copy. Payload files are streamed directly from
+    the member data of the source AIP .tar files into the output .tar file, without being
+    extracted to disk first. Additional files (e.g. metadata .xml and .xsd files) can be added
+    from disk.
+
+    Optionally, payload files with identical content are stored only once: Each further
+    occurrence is written as hardlink entry pointing to the first one. Only payloads, whose
+    size equals that of an already added payload, are hashed to detect duplicates.
+    """
+
+    _path: str | None
+    _out: StreamOutput | None
+    _tar: tarfile.TarFile
+    _stream: BinaryIO | None
+    _pool: TarPool
+    _ownpool: bool
+    _dedup: bool
+    _progress: Progress
+    _bysize: dict[int, list[list]]  # size -> [[name, source .tar, TarInfo, hash or None], ...]
+    _linked: int
+
+    CHUNKSIZE = 1024 * 1024
+
+    def __init__(self, target: str | BinaryIO, pool: TarPool = None, dedup: bool = False,
+                 compression: Compression = None, progress: Progress = None):
+        """Initialize and return a TarPacker object.
+
+        :param target: The path of the .tar file to be created (without the suffix of the compression codec,
+            the file must not exist yet) or a writable stream, to which the .tar file is written. The stream
+            isn't closed by the packer.
+        :param pool: The TarPool used to access the source .tar files (optional). If no pool
+            is given, the packer uses its own pool, which is closed together with the packer.
+        :param dedup: Whether payload files with identical content shall be stored only once (optional).
+        :param compression: The compression settings, already resolved for the payload (optional,
+            default: None = no compression).
+        :param progress: The Progress object, to which the copied files and bytes are reported (optional).
+        """
+        compression = compression or Compression()
+        if isinstance(target, str):
+            self._path = target + compression.getsuffix()
+            self._out = None
+            self._tar, self._stream = compression.open(self._path)
+        else:
+            self._path = None
+            self._out = StreamOutput(target)
+            self._tar, self._stream = compression.open(self._out)
+        self._ownpool = pool is None
+        self._pool = TarPool() if pool is None else pool
+        self._dedup = dedup
+        self._bysize = {}
+        self._linked = 0
+        self._progress = Progress() if progress is None else progress
+
+    def _digest(self, src: str, member: tarfile.TarInfo) -> str:
+        """Return the SHA-256 hash of the data of a (regular, not sparse) member of a source .tar file.
+
+        :param src: The path to the source .tar file.
+        :param member: The TarInfo of the member.
+        """
+        f = self._pool.get(src)
+        f.seek(member.offset_data)
+        h = hashlib.sha256()
+        remaining = member.size
+        while remaining > 0:
+            chunk = f.read(min(self.CHUNKSIZE, remaining))
+            if not chunk:
+                raise tarfile.ReadError("unexpected end of data in " + src)
+            h.update(chunk)
+            remaining -= len(chunk)
+        return h.hexdigest()
+
+    def _findduplicate(self, src: str, member: tarfile.TarInfo) -> str | None:
+        """Return the name of an already added payload with the same content as the given member.
+
+        The member is registered as added payload, if no duplicate is found.
+
+        :param src: The path to the source .tar file.
+        :param member: The TarInfo of the member (with the name it gets in the output .tar file).
+        :return: The name of the duplicate in the output .tar file, or None.
+        """
+        candidates = self._bysize.setdefault(member.size, [])
+        if candidates:
+            digest = self._digest(src, member)
+            for c in candidates:
+                if c[3] is None:
+                    c[3] = self._digest(c[1], c[2])
+                if c[3] == digest:
+                    return c[0]
+        else:
+            digest = None
+        candidates.append([member.name, src, member, digest])
+        return None
+
+    def addmember(self, src: str, member: tarfile.TarInfo, arcname: str = None):
+        """Copy a member of a source .tar file into the output .tar file.
+
+        The member's data is read from the source file starting at the data offset stored
+        in the given TarInfo, so the source archive's headers are not scanned again. A sparse
+        member is written as regular file (with its holes filled with zeros).
+
+        :param src: The path to the source .tar file.
+        :param member: The TarInfo of the member (e.g. taken from an AIP's member index).
+        :param arcname: The name of the member in the output .tar file (optional, defaults to the member's name).
+        """
+        if arcname is not None and arcname != member.name:
+            member = copy.copy(member)
+            member.name = arcname
+
+        self._progress.check()
+        f = self._pool.get(src)
+        if not member.isreg():
+            self._tar.addfile(member)
+            self._progress.advance(files=1)
+            return
+        if self._dedup and member.size > 0 and not member.issparse():
+            duplicate = self._findduplicate(src, member)
+            if duplicate is not None:
+                link = copy.copy(member)
+                link.type = tarfile.LNKTYPE
+                link.linkname = duplicate
+                link.size = 0
+                self._tar.addfile(link)
+                self._linked += 1
+                self._progress.advance(files=1, bytes_=member.size)
+                return
+
+        if member.issparse():
+            # The holes are restored from the sparse map, which tarfile only does for a TarFile's members. The
+            # source is opened at the member's header, so the TarFile doesn't depend on the file's position.
+            f.seek(member.offset)
+            data = tarfile.open(fileobj=f, mode="r:").extractfile(member)
+            # tarfile can't write sparse headers, so the member is written as regular file with the holes filled
+            member = copy.copy(member)
+            member.type = tarfile.REGTYPE
+            member.sparse = None
+            self._tar.addfile(member, self._progress.wrap(data))
+        else:
+            f.seek(member.offset_data)
+            self._tar.addfile(member, self._progress.wrap(f))
+        self._progress.advance(files=1)
+
+    def addmembers(self, src: str, members: list[tarfile.TarInfo]):
+        """Copy several members of the same source .tar file into the output .tar file.
+
+        The members are copied in the order of their position in the source file,
+        so the source file is read in a single forward pass.
+
+        :param src: The path to the source .tar file.
+        :param members: The TarInfos of the members (e.g. taken from an AIP's member index).
+        """
+        for member in sorted(members, key=lambda m: m.offset):
+            self.addmember(src, member)
+
+    def addpath(self, path: str, arcname: str):
+        """Add a file from disk to the output .tar file.
+
+        :param path: The path to the file.
+        :param arcname: The name of the file in the output .tar file.
+        """
+        self._tar.add(path, arcname=arcname)
+
+    def getpath(self) -> str | None:
+        """Return the path of the output .tar file (incl. the codec's suffix), or None, if it is written to a stream."""
+        return self._path
+
+    def getlinked(self) -> int:
+        """Return the number of payload files, that were written as hardlinks to identical payloads."""
+        return self._linked
+
+    def close(self):
+        """Finish and close the output .tar file (and the packer's own TarPool, if any)."""
+        try:
+            self._tar.close()
+        finally:
+            if self._stream is not None:
+                self._stream.close()
+        if self._ownpool:
+            self._pool.close()
+        if self._out is not None:
+            self._out.flush()
+
+    def abort(self):
+        """Close the packer after a failure or cancellation and remove the incomplete output .tar file.
+
+        An output stream is left as it is, without the end of the .tar file. As a .tar file cut off
+        between two members looks complete to many readers, the owner of the stream has to signal the
+        failure to the receiver (e.g. by closing the connection without finishing the HTTP response).
+        """
+        if self._out is not None:
+            self._out.detach()
+        with contextlib.suppress(Exception):
+            self.close()
+        if self._path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
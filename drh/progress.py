@@ -0,0 +1,158 @@
+"""Module for reporting the progress of DIP requests and for cancelling running requests."""
+
+import threading
+from typing import BinaryIO, Callable
+
+
+class Cancelled(BaseException):
+    """Raised inside a running request, as soon as its CancelToken has been cancelled.
+
+    Like asyncio.CancelledError, it derives from BaseException, so that it isn't caught by the
+    IPs' "except Exception" handlers, but ends the request (which then reports a CancelledError).
+    """
+
+
+class CancelToken:
+    """Token, with which a running request can be cancelled (e.g. from another thread)."""
+
+    _event: threading.Event
+
+    def __init__(self):
+        """Initialize and return a CancelToken object, that isn't cancelled yet."""
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Request the cancellation of the request(s) using this token."""
+        self._event.set()
+
+    def iscancelled(self) -> bool:
+        """Return whether the token has been cancelled."""
+        return self._event.is_set()
+
+    def check(self):
+        """Raise Cancelled, if the token has been cancelled."""
+        if self._event.is_set():
+            raise Cancelled()
+
+
+class Progress:
+    """Reporter for the progress of a request.
+
+    A request runs through the phases "parse" (reading the AIPs), "transform" (creating the
+    DIP metadata), "pack" (copying the payload files into a .tar file) and "write" (adding the
+    metadata files and finishing the .tar file). Each report is passed to the callback as
+    dictionary with the following keys:
+        * "phase": The current phase.
+        * "ip": The type of the Information Package being processed ("AIP", "DIP" or "VDIP").
+        * "files", "filestotal": The number of files (AIPs in the phase "parse") done so far and in total.
+        * "bytes", "bytestotal": The number of payload bytes copied so far and in total (0 outside of "pack").
+
+    Each report also checks the cancel token, so that a cancelled request stops at the next report.
+    """
+
+    _callback: Callable[[dict], None] | None
+    _token: CancelToken | None
+    _phase: str
+    _ip: str
+    _files: int
+    _filestotal: int
+    _bytes: int
+    _bytestotal: int
+    _unreported: int
+
+    INTERVAL = 1024 * 1024
+
+    def __init__(self, callback: Callable[[dict], None] = None, token: CancelToken = None):
+        """Initialize and return a Progress object.
+
+        :param callback: The function called with each report (optional, default: None = no reports).
+        :param token: The token, with which the request can be cancelled (optional).
+        """
+        self._callback = callback
+        self._token = token
+        self._phase = "parse"
+        self._ip = "AIP"
+        self._files = self._filestotal = self._bytes = self._bytestotal = self._unreported = 0
+
+    def start(self, phase: str, ip: str, filestotal: int, bytestotal: int = 0):
+        """Start a new phase (resetting all counters) and report it.
+
+        :param phase: The phase ("parse", "transform", "pack" or "write").
+        :param ip: The type of the Information Package being processed.
+        :param filestotal: The number of files (resp. AIPs) to be processed in the phase.
+        :param bytestotal: The number of bytes to be copied in the phase (optional).
+        """
+        self._phase = phase
+        self._ip = ip
+        self._files = 0
+        self._filestotal = filestotal
+        self._bytes = 0
+        self._bytestotal = bytestotal
+        self._unreported = 0
+        self.report()
+
+    def advance(self, files: int = 0, bytes_: int = 0):
+        """Count the given number of files and bytes as done.
+
+        A report is sent for every finished file and, while a file is being copied, for every
+        INTERVAL bytes copied.
+
+        :param files: The number of files (resp. AIPs) done.
+        :param bytes_: The number of bytes copied.
+        """
+        self._files += files
+        self._bytes += bytes_
+        self._unreported += bytes_
+        if files or self._unreported >= self.INTERVAL:
+            self.report()
+        elif self._token is not None:
+            self._token.check()
+
+    def report(self):
+        """Check the cancel token and pass the current state to the callback."""
+        self.check()
+        self._unreported = 0
+        if self._callback is not None:
+            self._callback({
+                "phase": self._phase,
+                "ip": self._ip,
+                "files": self._files,
+                "filestotal": self._filestotal,
+                "bytes": self._bytes,
+                "bytestotal": self._bytestotal
+            })
+
+    def check(self):
+        """Raise Cancelled, if the request has been cancelled."""
+        if self._token is not None:
+            self._token.check()
+
+    def wrap(self, f: BinaryIO) -> "ProgressReader":
+        """Return a wrapper of the given (binary, readable) file, that counts all bytes read as copied."""
+        return ProgressReader(f, self)
+
+
+class ProgressReader:
+    """Wrapper of a readable file, that reports every read to a Progress object.
+
+    As the wrapper checks for cancellation on each read, even the copying of a single large
+    file stops soon after a request has been cancelled.
+    """
+
+    _f: BinaryIO
+    _progress: Progress
+
+    def __init__(self, f: BinaryIO, progress: Progress):
+        """Initialize and return a ProgressReader object.
+
+        :param f: The (binary, readable) file.
+        :param progress: The Progress object, to which the reads are reported.
+        """
+        self._f = f
+        self._progress = progress
+
+    def read(self, size: int = -1) -> bytes:
+        """Read and return up to size bytes from the file."""
+        data = self._f.read(size)
+        self._progress.advance(bytes_=len(data))
+        return data
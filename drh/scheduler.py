@@ -0,0 +1,294 @@
+"""Module for a scheduler, that runs queued DIP requests concurrently on one DIP Request Handler."""
+
+import itertools
+import queue
+import threading
+import time
+import traceback
+import uuid
+from typing import BinaryIO
+
+from drh.drh import DIPRequestHandler, DrhResponse
+from drh.err import CancelledError, DrhError
+from drh.progress import CancelToken
+
+
+class Job:
+    """A DIP request submitted to a Scheduler.
+
+    A job is "queued" until a worker of the scheduler starts it, then "running" and finally
+    "done" (the response has no errors), "failed" (the response has errors) or "cancelled".
+    """
+
+    _id: str
+    _uchoices: dict
+    _priority: int
+    _stream: BinaryIO | None
+    _status: str
+    _progress: dict | None
+    _response: DrhResponse | None
+    _token: CancelToken
+    _done: threading.Event
+    _submitted: float
+    _started: float | None
+    _finished: float | None
+
+    def __init__(self, uchoices: dict, priority: int = 0, stream: BinaryIO = None):
+        """Initialize and return a queued Job object.
+
+        :param uchoices: The user choices passed to DIPRequestHandler.startrequest.
+        :param priority: The job's priority. Jobs with a higher priority are started first.
+        :param stream: The stream, to which the (View)DIP is written (optional, default: None = the job's
+            request is saved to its "outputPath", see DIPRequestHandler.streamrequest).
+        """
+        self._id = uuid.uuid4().hex
+        self._uchoices = uchoices
+        self._priority = priority
+        self._stream = stream
+        self._status = "queued"
+        self._progress = None
+        self._response = None
+        self._token = CancelToken()
+        self._done = threading.Event()
+        self._submitted = time.time()
+        self._started = None
+        self._finished = None
+
+    def getid(self) -> str:
+        """Return the job's ID."""
+        return self._id
+
+    def getuchoices(self) -> dict:
+        """Return the user choices of the job's request."""
+        return self._uchoices
+
+    def getpriority(self) -> int:
+        """Return the job's priority."""
+        return self._priority
+
+    def getstream(self) -> BinaryIO | None:
+        """Return the stream, to which the job's (View)DIP is written, or None."""
+        return self._stream
+
+    def getstatus(self) -> str:
+        """Return the job's status ("queued", "running", "done", "failed" or "cancelled")."""
+        return self._status
+
+    def getprogress(self) -> dict | None:
+        """Return the last progress report of the running job (see drh.progress.Progress), or None."""
+        return self._progress
+
+    def getresponse(self) -> DrhResponse | None:
+        """Return the response of the finished job, or None, if the job hasn't finished yet."""
+        return self._response
+
+    def gettimes(self) -> dict:
+        """Return the times (as UNIX timestamps), when the job was submitted, started and finished."""
+        return {
+            "submitted": self._submitted,
+            "started": self._started,
+            "finished": self._finished
+        }
+
+    def isdone(self) -> bool:
+        """Return, whether the job has finished (successfully or not) or was cancelled."""
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until the job has finished.
+
+        :param timeout: The maximum time to wait in seconds (optional, default: None = no limit).
+        :return: Whether the job has finished.
+        """
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        """Cancel the job.
+
+        A queued job is never started. A running job stops at its next progress report and
+        removes its incomplete output file (see DIPRequestHandler.startrequest).
+        """
+        self._token.cancel()
+
+    def gettoken(self) -> CancelToken:
+        """Return the token, with which the job's request is cancelled."""
+        return self._token
+
+    def setprogress(self, progress: dict):
+        """Store the last progress report of the running job (called by the Scheduler)."""
+        self._progress = progress
+
+    def start(self):
+        """Mark the job as running (called by the Scheduler)."""
+        self._status = "running"
+        self._started = time.time()
+
+    def finish(self, response: DrhResponse):
+        """Store the response of the job's request and mark the job as finished (called by the Scheduler).
+
+        :param response: The response of the request.
+        """
+        self._response = response
+        errors = response.getfullresponse()["errors"]
+        if any(isinstance(e, CancelledError) for e in errors):
+            self._status = "cancelled"
+        else:
+            self._status = "failed" if errors else "done"
+        self._finished = time.time()
+        self._done.set()
+
+
+class Scheduler:
+    """Scheduler running queued DIP requests concurrently on one shared DIPRequestHandler.
+
+    Submitted jobs wait in a priority queue and are started by a fixed number of worker threads.
+    Additionally, the number of jobs in each phase of a request can be limited per resource:
+        * "parse": Reading the AIP .tar files (phase "parse").
+        * "transform": Creating the DIP metadata with Saxon (phase "transform", CPU-bound).
+        * "pack": Copying the payload and writing the .tar files (phases "pack" and "write", I/O-bound).
+
+    A job waits at the beginning of a phase, until its resource is free, and it holds at most
+    one resource at a time. As the DIPRequestHandler serializes all calls into Saxon, more than
+    one concurrent transformation only helps, if the stylesheets of the profiles differ.
+    """
+
+    _drh: DIPRequestHandler
+    _queue: queue.PriorityQueue
+    _jobs: dict[str, Job]
+    _lock: threading.Lock
+    _counter: itertools.count
+    _limits: dict[str, threading.Semaphore]
+    _threads: list[threading.Thread]
+
+    RESOURCES = {"parse": "parse", "transform": "transform", "pack": "pack", "write": "pack"}
+    POLL = 0.2
+
+    def __init__(self, drh: DIPRequestHandler, workers: int = 4, limits: dict[str, int] = None):
+        """Initialize a Scheduler object and start its worker threads.
+
+        :param drh: The DIPRequestHandler executing the requests.
+        :param workers: The maximum number of jobs running at once (optional).
+        :param limits: The maximum number of jobs using each resource at once, with the resources as keys
+            (optional, default: {"transform": 1, "pack": 2}, a missing resource isn't limited).
+        """
+        self._drh = drh
+        self._queue = queue.PriorityQueue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        limits = {"transform": 1, "pack": 2} if limits is None else limits
+        self._limits = {resource: threading.Semaphore(n) for resource, n in limits.items()}
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name="drh-scheduler-" + str(i), daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, uchoices: dict, priority: int = 0, stream: BinaryIO = None) -> Job:
+        """Queue a request for a DIP generation.
+
+        :param uchoices: The user choices passed to DIPRequestHandler.startrequest.
+        :param priority: The job's priority. Jobs with a higher priority are started first, jobs with the
+            same priority in the order of their submission (optional, default: 0).
+        :param stream: The stream, to which the (View)DIP shall be written instead of the "outputPath"
+            (optional, see DIPRequestHandler.streamrequest).
+        :return: The queued job.
+        """
+        job = Job(uchoices, priority, stream)
+        with self._lock:
+            self._jobs[job.getid()] = job
+        self._queue.put((-priority, next(self._counter), job))
+        return job
+
+    def getjob(self, id_: str) -> Job | None:
+        """Return the job with the given ID, or None, if there is no such job."""
+        with self._lock:
+            return self._jobs.get(id_)
+
+    def getjobs(self) -> list[Job]:
+        """Return all jobs (queued, running and finished) in the order of their submission."""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, id_: str) -> bool:
+        """Cancel the job with the given ID (see Job.cancel).
+
+        :return: Whether a job with the given ID exists.
+        """
+        job = self.getjob(id_)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def forget(self, id_: str):
+        """Remove the finished job with the given ID from the scheduler's list of jobs."""
+        with self._lock:
+            job = self._jobs.get(id_)
+            if job is not None and job.isdone():
+                del self._jobs[id_]
+
+    def shutdown(self, cancel: bool = False):
+        """Stop the worker threads after all queued jobs have been processed.
+
+        :param cancel: Whether all queued and running jobs shall be cancelled (optional, default: False).
+        """
+        if cancel:
+            for job in self.getjobs():
+                job.cancel()
+        for _ in self._threads:
+            self._queue.put((float("inf"), next(self._counter), None))
+        for t in self._threads:
+            t.join()
+
+    def _work(self):
+        """Run the queued jobs until the scheduler is shut down."""
+        while True:
+            job = self._queue.get()[2]
+            if job is None:
+                return
+            self._run(job)
+
+    def _run(self, job: Job):
+        """Run the given job and store its response.
+
+        :param job: The job to be run.
+        """
+        if job.gettoken().iscancelled():
+            response = DrhResponse()
+            response.newerror(CancelledError(job.getuchoices().get("outputPath")))
+            job.finish(response)
+            return
+
+        held = []
+
+        def report(progress: dict):
+            # Switch the resource, when the request enters a new phase. The token is checked
+            # while waiting, so a job waiting for a resource can be cancelled as well.
+            job.setprogress(progress)
+            resource = self.RESOURCES.get(progress["phase"])
+            if held and held[0] == resource:
+                return
+            self._release(held)
+            if resource in self._limits:
+                while not self._limits[resource].acquire(timeout=self.POLL):
+                    job.gettoken().check()
+                held.append(resource)
+
+        job.start()
+        try:
+            if job.getstream() is None:
+                response = self._drh.startrequest(job.getuchoices(), report, job.gettoken())
+            else:
+                response = self._drh.streamrequest(job.getuchoices(), job.getstream(), report, job.gettoken())
+        except Exception as e:
+            response = DrhResponse()
+            response.newerror(DrhError("".join(traceback.format_exception(e, limit=10)), True))
+        finally:
+            self._release(held)
+        job.finish(response)
+
+    def _release(self, held: list[str]):
+        """Release the resources in the given list and empty it."""
+        while held:
+            self._limits[held.pop()].release()
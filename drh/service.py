@@ -0,0 +1,486 @@
+"""Module for a local HTTP service, that makes the DIP Request Handler available as JSON API."""
+
+import asyncio
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import unquote
+
+from drh.drh import DIPRequestHandler
+from drh.err import AIPError, DrhError, FormatError, IEError, PathError, StreamError
+from drh.scheduler import Job, Scheduler
+
+
+class HttpError(Exception):
+    """Exception ending the handling of an HTTP request with an error response."""
+
+    def __init__(self, status: HTTPStatus, message: str = None):
+        """Initialize and return an HttpError object.
+
+        :param status: The HTTP status of the response.
+        :param message: The error message sent to the client (optional, default: the status phrase).
+        """
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.message = message or status.phrase
+
+
+class ChunkedWriter:
+    """Writable stream, to which a worker thread writes the body of a chunked HTTP response.
+
+    The status line and the headers are sent together with the first data, so a request failing
+    before can still be answered with an error response. The data is sent in chunks of about
+    CHUNKSIZE bytes. The writing thread waits, until the event loop has passed each chunk to the
+    client, so a slow client slows down the request instead of filling the memory.
+    """
+
+    _writer: asyncio.StreamWriter
+    _loop: asyncio.AbstractEventLoop
+    _head: bytes | None
+    _ready: threading.Event
+    _buffer: bytearray
+    _started: bool
+
+    CHUNKSIZE = 256 * 1024
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+        """Initialize and return a ChunkedWriter object.
+
+        :param writer: The writer of the connection, to which the response is sent.
+        :param loop: The event loop running the connection.
+        """
+        self._writer = writer
+        self._loop = loop
+        self._head = None
+        self._ready = threading.Event()
+        self._buffer = bytearray()
+        self._started = False
+
+    def open(self, head: bytes):
+        """Set the status line and the headers of the response. Writing data waits until they are set."""
+        self._head = head
+        self._ready.set()
+
+    def isstarted(self) -> bool:
+        """Return, whether the response has (at least partially) been sent."""
+        return self._started
+
+    def write(self, data: bytes) -> int:
+        """Write data to the response body and return the number of bytes written."""
+        self._buffer += data
+        if len(self._buffer) >= self.CHUNKSIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        """Send the buffered data as chunk and wait until the event loop has passed it to the client."""
+        if not self._buffer:
+            return
+        self._ready.wait()
+        data = b"%x\r\n" % len(self._buffer) + bytes(self._buffer) + b"\r\n"
+        if not self._started:
+            data = self._head + data
+            self._started = True
+        self._buffer = bytearray()
+        asyncio.run_coroutine_threadsafe(self._send(data), self._loop).result()
+
+    async def _send(self, data: bytes):
+        self._writer.write(data)
+        await self._writer.drain()
+
+
+class DrhService:
+    """Local HTTP service exposing a DIPRequestHandler as JSON API.
+
+    The service is built on asyncio streams of the standard library and offers the following endpoints:
+        * GET /profiles: The overview of all profiles (see DIPRequestHandler.getprofileinfo) and the
+          index of the default profile.
+        * GET /profiles/<index>: The full description and the delivery and AIP defaults of a profile.
+        * POST /aipinfo: The info dictionary about AIPs (see DIPRequestHandler.getaipinfo). The body is
+          an object with the keys "paths" (a directory or a list of .tar files) and "vze" (optional).
+        * POST /requests: Queue a DIP request. The body contains the user choices (see
+          DIPRequestHandler.startrequest, without "outputPath") and optionally a "priority".
+          The response (status 202) contains the job's ID and status.
+        * GET /requests: The status of all jobs.
+        * GET /requests/<id>: The status, progress and (when finished) the response and the generated
+          files of a job.
+        * DELETE /requests/<id>: Cancel a job, that hasn't finished yet, resp. remove a finished job and
+          its output directory.
+        * GET /requests/<id>/files/<name>: Download a file generated by a finished job (with the name
+          listed in the job's status).
+        * POST /stream: Run a DIP request and stream its .tar file as chunked response, while it is
+          generated (see DIPRequestHandler.streamrequest). The body is the same as for POST /requests,
+          but the "deliveryType" must be "download" (the DIP) or "viewer" (the ViewDIP). The response
+          header X-Request-Id contains the job's ID. If the request fails before the first data has
+          been sent, the response is the job's status as JSON. If it fails afterwards, the connection
+          is closed without the final chunk, so the client can recognize the incomplete download.
+
+    The requests are run by a Scheduler, each with an output directory of its own below the service's
+    output directory. Finished jobs are removed (incl. their output directories) after a retention
+    time, unless a client removes them earlier. Downloads are sent with loop.sendfile, which uses
+    os.sendfile (i.e. without copying the file through Python) where the platform supports it.
+    AIP paths sent by clients are resolved relative to the AIP root and must not leave it.
+    """
+
+    _drh: DIPRequestHandler
+    _scheduler: Scheduler
+    _outdir: str
+    _aiproot: str
+    _host: str
+    _port: int
+    _keep: float
+
+    MAXBODY = 1024 * 1024
+    MAXHEADERS = 100
+    TIMEOUT = 30
+    POLL = 0.1
+    SWEEP = 60
+    # Status of a streamed request, that failed before sending data, by the type of its error
+    ERRORSTATUS = {StreamError: HTTPStatus.BAD_REQUEST, FormatError: HTTPStatus.BAD_REQUEST,
+                   AIPError: HTTPStatus.BAD_REQUEST, IEError: HTTPStatus.BAD_REQUEST, PathError: HTTPStatus.NOT_FOUND}
+
+    def __init__(self, drh: DIPRequestHandler, scheduler: Scheduler, outdir: str, aiproot: str,
+                 host: str = "127.0.0.1", port: int = 8080, keep: float = 24 * 3600):
+        """Initialize and return a DrhService object.
+
+        :param drh: The DIPRequestHandler answering the info requests.
+        :param scheduler: The Scheduler running the DIP requests (on the same DIPRequestHandler).
+        :param outdir: The path of the directory, in which the jobs' output directories are created.
+        :param aiproot: The path of the directory, to which all AIP paths are relative.
+        :param host: The address the service listens on (optional, default: only the local host).
+        :param port: The port the service listens on (optional).
+        :param keep: The time (in seconds), for which finished jobs and their output directories are kept
+            (optional, default: one day).
+        """
+        self._drh = drh
+        self._scheduler = scheduler
+        self._outdir = os.path.abspath(outdir)
+        self._aiproot = os.path.abspath(aiproot)
+        self._host = host
+        self._port = port
+        self._keep = keep
+        os.makedirs(self._outdir, exist_ok=True)
+
+    def run(self):
+        """Run the service until it is interrupted."""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """Serve HTTP requests until the task is cancelled."""
+        server = await asyncio.start_server(self._handle, self._host, self._port)
+        sweeper = asyncio.create_task(self._sweep())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+
+    async def _sweep(self):
+        """Remove the jobs, that finished longer than the retention time ago, until the task is cancelled."""
+        while True:
+            await asyncio.sleep(self.SWEEP)
+            now = time.time()
+            for job in self._scheduler.getjobs():
+                if job.isdone() and now - job.gettimes()["finished"] > self._keep:
+                    await self._remove(job)
+
+    async def _remove(self, job: Job):
+        """Remove the given finished job from the scheduler and delete its output directory."""
+        self._scheduler.forget(job.getid())
+        if job.getstream() is None:
+            await asyncio.get_running_loop().run_in_executor(None, partial(shutil.rmtree, self._jobdir(job),
+                                                                           ignore_errors=True))
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Read one HTTP request from the connection, answer it and close the connection."""
+        try:
+            try:
+                method, path, body = await asyncio.wait_for(self._read(reader), self.TIMEOUT)
+                await self._route(method, path, body, writer)
+            except HttpError as e:
+                await self._sendjson(writer, {"error": e.message}, e.status)
+            except Exception as e:
+                await self._sendjson(writer, {"error": repr(e)}, HTTPStatus.INTERNAL_SERVER_ERROR)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read(self, reader: asyncio.StreamReader) -> (str, str, bytes):
+        """Read an HTTP request and return its method, path and body.
+
+        :raise HttpError: If the request is malformed or too large.
+        """
+        line = (await reader.readline()).decode("latin-1").split()
+        if len(line) != 3 or not line[2].startswith("HTTP/"):
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        headers = {}
+        while True:
+            header = (await reader.readline()).decode("latin-1")
+            if header in ("\r\n", "\n", ""):
+                break
+            if len(headers) >= self.MAXHEADERS or ":" not in header:
+                raise HttpError(HTTPStatus.BAD_REQUEST)
+            name, value = header.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST)
+        if length > self.MAXBODY:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length) if length > 0 else b""
+        return line[0], line[1].split("?", 1)[0], body
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        """Answer the request for the given method and path.
+
+        :raise HttpError: If there is no such endpoint or the request can't be answered.
+        """
+        parts = [p for p in unquote(path).split("/") if p]
+        if parts == ["profiles"]:
+            self._allow(method, "GET")
+            info = self._drh.getprofileinfo()
+            info.update({"default": self._drh.getdefaultprofile()})
+            await self._sendjson(writer, info)
+        elif len(parts) == 2 and parts[0] == "profiles":
+            self._allow(method, "GET")
+            await self._sendjson(writer, self._profile(parts[1]))
+        elif parts == ["aipinfo"]:
+            self._allow(method, "POST")
+            req = self._json(body)
+            paths = req.get("paths")
+            paths = [self._aippath(p) for p in paths] if isinstance(paths, list) else self._aippath(paths)
+            vze = self._aippath(req["vze"]) if req.get("vze") is not None else None
+            resp = await asyncio.get_running_loop().run_in_executor(None, self._drh.getaipinfo, paths, vze)
+            await self._sendjson(writer, {
+                "info": resp.getinfo(),
+                "errors": [e.todict() for e in resp.geterrors()]
+            })
+        elif parts == ["requests"]:
+            if method == "POST":
+                job = self._submit(self._json(body))
+                await self._sendjson(writer, self._jobinfo(job), HTTPStatus.ACCEPTED)
+            else:
+                self._allow(method, "GET")
+                await self._sendjson(writer, [self._jobinfo(j) for j in self._scheduler.getjobs()])
+        elif len(parts) == 2 and parts[0] == "requests":
+            job = self._job(parts[1])
+            if method == "DELETE" and job.isdone():
+                await self._remove(job)
+                await self._sendjson(writer, {"id": job.getid(), "removed": True})
+                return
+            if method == "DELETE":
+                job.cancel()
+            else:
+                self._allow(method, "GET")
+            await self._sendjson(writer, self._jobinfo(job))
+        elif len(parts) >= 4 and parts[0] == "requests" and parts[2] == "files":
+            self._allow(method, "GET")
+            job = self._job(parts[1])
+            name = "/".join(parts[3:])
+            if name not in self._files(job):
+                raise HttpError(HTTPStatus.NOT_FOUND, "No such file: " + name)
+            await self._sendfile(writer, os.path.join(self._jobdir(job), name))
+        elif parts == ["stream"]:
+            self._allow(method, "POST")
+            await self._stream(writer, self._json(body))
+        else:
+            raise HttpError(HTTPStatus.NOT_FOUND, "No such endpoint: " + path)
+
+    @staticmethod
+    def _allow(method: str, allowed: str):
+        """Raise an HttpError, if the given method isn't the allowed one."""
+        if method != allowed:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+    @staticmethod
+    def _json(body: bytes) -> dict:
+        """Return the given request body parsed as JSON object."""
+        try:
+            req = json.loads(body)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "The body is no valid JSON.")
+        if not isinstance(req, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "The body must be a JSON object.")
+        return req
+
+    def _aippath(self, path) -> str:
+        """Return the absolute path for the given AIP path (relative to the AIP root)."""
+        if not isinstance(path, str) or not path:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "AIP paths must be non-empty strings.")
+        full = os.path.abspath(os.path.join(self._aiproot, path))
+        if os.path.commonpath([full, self._aiproot]) != self._aiproot:
+            raise HttpError(HTTPStatus.FORBIDDEN, "AIP paths must be inside the AIP root.")
+        return full
+
+    def _profile(self, index: str) -> dict:
+        """Return the description and the defaults of the profile with the given index."""
+        if not re.fullmatch(r"\d+", index) or int(index) >= len(self._drh.getprofileinfo()["nos"]):
+            raise HttpError(HTTPStatus.NOT_FOUND, "No such profile: " + index)
+        no = int(index)
+        return {
+            "desc": self._drh.getprofileinfo(no),
+            "defaultDelivery": self._drh.getdefaultdelivery(no),
+            "deliveryChoice": self._drh.deliverychoice(no),
+            "deliveryMessage": self._drh.getdeliverymessage(no),
+            "defaultAIP": self._drh.getdefaultaips(no),
+            "AIPChoice": self._drh.aipchoice(no),
+            "AIPMessage": self._drh.getaipmessage(no)
+        }
+
+    def _submit(self, req: dict) -> Job:
+        """Queue the DIP request with the given user choices and return its job."""
+        uchoices, priority = self._uchoices(req, ("viewer", "download", "both"))
+        uchoices.update({"outputPath": tempfile.mkdtemp(prefix="request-", dir=self._outdir)})
+        return self._scheduler.submit(uchoices, priority)
+
+    async def _stream(self, writer: asyncio.StreamWriter, req: dict):
+        """Run the DIP request with the given user choices and send its .tar file as chunked response."""
+        uchoices, priority = self._uchoices(req, ("download", "viewer"))
+        out = ChunkedWriter(writer, asyncio.get_running_loop())
+        job = self._scheduler.submit(uchoices, priority, out)
+        out.open(self._head(HTTPStatus.OK, {
+            "Content-Type": "application/octet-stream",
+            "Content-Disposition": "attachment",
+            "Transfer-Encoding": "chunked",
+            "X-Request-Id": job.getid()
+        }))
+        while not job.isdone():
+            await asyncio.sleep(self.POLL)
+
+        errors = job.getresponse().getfullresponse()["errors"]
+        if not out.isstarted():
+            await self._sendjson(writer, self._jobinfo(job), self._errorstatus(errors))
+        elif errors:
+            writer.transport.abort()
+        else:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+    def _errorstatus(self, errors: list[DrhError]) -> HTTPStatus:
+        """Return the HTTP status for a request, that failed with the given errors.
+
+        Errors caused by the client's choices (e.g. a missing or invalid AIP) result in a client error,
+        all others in an internal server error.
+        """
+        for e in errors:
+            for type_, status in self.ERRORSTATUS.items():
+                if isinstance(e, type_):
+                    return status
+        return HTTPStatus.INTERNAL_SERVER_ERROR
+
+    def _uchoices(self, req: dict, deliveries: tuple[str, ...]) -> (dict, int):
+        """Return the user choices (without "outputPath") and the priority of the given DIP request.
+
+        :param req: The body of the request.
+        :param deliveries: The allowed delivery types.
+        :raise HttpError: If the request is incomplete or invalid.
+        """
+        aips = req.get("chosenAips")
+        if not isinstance(aips, list) or not aips:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "\"chosenAips\" must be a non-empty list.")
+        if not isinstance(req.get("profileNo"), int) or \
+                not 0 <= req["profileNo"] < len(self._drh.getprofileinfo()["nos"]):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "\"profileNo\" must be the index of a profile.")
+        delivery = req.get("deliveryType", self._drh.getdefaultdelivery(req["profileNo"]))
+        if delivery not in deliveries:
+            raise HttpError(HTTPStatus.BAD_REQUEST,
+                            "\"deliveryType\" must be one of: " + ", ".join("\"" + d + "\"" for d in deliveries))
+        priority = req.get("priority", 0)
+        if not isinstance(priority, int):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "\"priority\" must be an integer.")
+
+        uchoices = {
+            "vzePath": None,
+            "profileNo": req["profileNo"],
+            "deliveryType": delivery,
+            "chosenAips": [self._aippath(p) for p in aips]
+        }
+        return uchoices, priority
+
+    def _job(self, id_: str) -> Job:
+        """Return the job with the given ID."""
+        job = self._scheduler.getjob(id_)
+        if job is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, "No such request: " + id_)
+        return job
+
+    @staticmethod
+    def _jobdir(job: Job) -> str:
+        """Return the output directory of the given job."""
+        return job.getuchoices()["outputPath"]
+
+    def _files(self, job: Job) -> list[str]:
+        """Return the names of the files generated by the given job (relative to its output directory).
+
+        The files are only listed, when the job is done, as they are incomplete before. Streamed
+        jobs have no files.
+        """
+        if job.getstatus() != "done" or job.getstream() is not None:
+            return []
+        files = []
+        for dir_, _, names in os.walk(self._jobdir(job)):
+            rel = os.path.relpath(dir_, self._jobdir(job))
+            files.extend(n if rel == "." else rel + "/" + n for n in names)
+        return sorted(files)
+
+    def _jobinfo(self, job: Job) -> dict:
+        """Return the state of the given job as JSON serializable dictionary."""
+        info = {
+            "id": job.getid(),
+            "status": job.getstatus(),
+            "priority": job.getpriority(),
+            "progress": job.getprogress(),
+            "times": job.gettimes()
+        }
+        if job.isdone():
+            resp = job.getresponse().getfullresponse()
+            info.update({
+                "success": resp["success"],
+                "errors": [e.todict() for e in resp["errors"]],
+                "files": self._files(job)
+            })
+        return info
+
+    @staticmethod
+    async def _sendjson(writer: asyncio.StreamWriter, obj, status: HTTPStatus = HTTPStatus.OK):
+        """Send the given object as JSON response."""
+        # Sets (e.g. the formats in the AIP info) are sent as sorted lists
+        body = json.dumps(obj, ensure_ascii=False, default=lambda o: sorted(o) if isinstance(o, set) else str(o))
+        body = body.encode("utf-8")
+        writer.write(DrhService._head(status, {
+            "Content-Type": "application/json; charset=utf-8",
+            "Content-Length": str(len(body))
+        }) + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _sendfile(writer: asyncio.StreamWriter, path: str):
+        """Send the given file as download response."""
+        # Compressed .tar files are sent as they are, not as .tar with a content encoding
+        type_, encoding = mimetypes.guess_type(path)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            writer.write(DrhService._head(HTTPStatus.OK, {
+                "Content-Type": type_ if type_ and not encoding else "application/octet-stream",
+                "Content-Length": str(size),
+                "Content-Disposition": "attachment; filename=\"" + os.path.basename(path) + "\""
+            }))
+            await writer.drain()
+            await asyncio.get_running_loop().sendfile(writer.transport, f)
+
+    @staticmethod
+    def _head(status: HTTPStatus, headers: dict[str, str]) -> bytes:
+        """Return the status line and the given headers of a response."""
+        lines = ["HTTP/1.1 " + str(status.value) + " " + status.phrase]
+        lines.extend(name + ": " + value for name, value in headers.items())
+        lines.append("Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
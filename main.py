@@ -11,7 +11,8 @@ conf = "profile_conf.json"
 vconfdir = "config/VDIP/"
 vconf = "profile_conf.json"
 texts = "config/guitexts.json"
+index = "cache/aipindex.sqlite"
 
-drh = DIPRequestHandler(confdir, conf, vconfdir, vconf)
+drh = DIPRequestHandler(confdir, conf, vconfdir, vconf, indexpath=index)
 
 rv = RequestViewer(drh, texts)
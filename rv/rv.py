@@ -1,8 +1,10 @@
 import sys
+from PySide6.QtCore import Qt, QThreadPool
 from PySide6.QtWidgets import QApplication, QAbstractButton
-from drh.drh import DIPRequestHandler
-from drh.err import NoPathError
+from drh.drh import DIPRequestHandler, DrhResponse, InfoResponse
+from drh.err import DrhError, NoPathError
 from rv.gui import RvMainWindow, MessageBox, MsgTrigger, MsgType
+from rv.worker import Worker
 
 
 class RequestViewer:
@@ -14,6 +16,11 @@ class RequestViewer:
     _delivery: str
     _profile: int
     _output: str
+    _pool: QThreadPool
+    _workers: set[Worker]
+    _loading: bool
+    _running: bool
+    _runningdelivery: str | None
 
     def __init__(self, drh: DIPRequestHandler, texts: str):
         """Initialize and return a new Request Viewer object."""
@@ -28,6 +35,15 @@ class RequestViewer:
         self._output = None
         self._pinfo = self._drh.getprofileinfo()
 
+        # Long-running calls of the DIPRequestHandler (loading AIPs, requests) run in a background thread,
+        # so that the GUI stays responsive. They run one after another, as they share the handler's caches.
+        self._pool = QThreadPool()
+        self._pool.setMaxThreadCount(1)
+        self._workers = set()
+        self._loading = False
+        self._running = False
+        self._runningdelivery = None
+
         # User choice markers: Has the user already chosen a profile, an aip, a delivery?
         # If not, default settings shall be used, when the user changes a profile.
         # If he has already chosen himself, those choices shall not be overruled!
@@ -63,6 +79,29 @@ class RequestViewer:
         self.window.show()
         self.app.exec()
 
+    def _runinbackground(self, finished, failed, fn, *args, **kwargs):
+        """Call the given function in the background thread and hand its result to the given handler.
+
+        :param finished: The handler called (in the GUI thread) with the function's result.
+        :param failed: The handler called (in the GUI thread) with the traceback, if the function raised an exception.
+        :param fn: The function to be called.
+        """
+
+        worker = Worker(fn, *args, **kwargs)
+        worker.setAutoDelete(False)
+        self._workers.add(worker)
+
+        def release(handler):
+            """Return a slot, that releases the worker and passes the emitted value on to the given handler."""
+            def slot(value):
+                self._workers.discard(worker)
+                handler(value)
+            return slot
+
+        worker.signals.finished.connect(release(finished), Qt.QueuedConnection)
+        worker.signals.failed.connect(release(failed), Qt.QueuedConnection)
+        self._pool.start(worker)
+
     def _setclickhandlers(self):
         """Set the input handlers for the viewer's components."""
 
@@ -269,23 +308,58 @@ class RequestViewer:
             msg.show()
             return
 
-        # Remove all present AIPs
+        # Only one load at a time
+        if self._loading:
+            return
+
+        # Remove all present AIPs (and the choices referring to them)
         self._aips = []
+        self._chosenaips = []
         self.window.closeAips()
+        self._aipconfirmneeded = True
+        self._updateguidance()
+
+        # No request and no further load can be started, until the AIPs are shown
+        self._loading = True
+        self.window.goButton.enable(False)
+        self.window.spinnerGoBtn.enable(False)
 
-        # Set new AIPs
+        # Set new AIPs (in the background)
         # vze = self.window.vzeFileSpinner.paths # VZE
-        resp = self._drh.getaipinfo(aips, vze=None)
+        QApplication.setOverrideCursor(Qt.BusyCursor)
+        self._runinbackground(self._showaips, self._loadfailed, self._drh.getaipinfo, aips, vze=None)
+
+    def _loadfailed(self, tb: str):
+        """Show an error message, if loading the AIPs failed unexpectedly."""
+
+        QApplication.restoreOverrideCursor()
+        self._finishload()
+        msg = MessageBox(self.window, MsgType.ERROR, MsgTrigger.LOAD, self.texts, [DrhError(tb, True)])
+        msg.show()
+
+    def _finishload(self):
+        """Enable the load button and the Go button again after loading AIPs."""
+
+        self._loading = False
+        self.window.spinnerGoBtn.enable(True)
+        self.window.goButton.enable(True)
+        self._updateguidance()
+
+    def _showaips(self, resp: InfoResponse):
+        """Show the AIPs loaded in the background."""
+
+        QApplication.restoreOverrideCursor()
         info = resp.getinfo()
         errs = resp.geterrors()
         if info is not None:
             self._aips = info["aipinfo"]
             self._aipconfirmneeded = False
-            self._updateguidance()
+            self._finishload()
             if errs:
                 msg = MessageBox(self.window, MsgType.WARNING, MsgTrigger.LOAD, self.texts, errs)
                 msg.show()
         else:
+            self._finishload()
             msg = MessageBox(self.window, MsgType.ERROR, MsgTrigger.LOAD, self.texts, errs)
             msg.show()
             return
@@ -399,7 +473,12 @@ class RequestViewer:
             return
 
     def _startrequest(self):
-        """Start a request and handle the response."""
+        """Start a request in the background."""
+
+        # Only one request at a time, and none while AIPs are being loaded
+        if self._running or self._loading:
+            self.window.goButton.setChecked(False)
+            return
 
         # Create a user choice dictionary.
         uc = {
@@ -409,13 +488,30 @@ class RequestViewer:
             "outputPath": self.window.outFileSpinner.paths,
             "chosenAips": [self._aips[i]["path"] for i in self._chosenaips]
         }
-        resp = self._drh.startrequest(uc).getfullresponse()
+        self._running = True
+        # The delivery type may be changed in the GUI, while the request is running
+        self._runningdelivery = uc["deliveryType"]
+        QApplication.setOverrideCursor(Qt.BusyCursor)
+        self._runinbackground(self._finishrequest, self._requestfailed, self._drh.startrequest, uc)
+
+    def _requestfailed(self, tb: str):
+        """Handle a request, that failed unexpectedly."""
+
+        resp = DrhResponse()
+        resp.newerror(DrhError(tb, True))
+        self._finishrequest(resp)
+
+    def _finishrequest(self, response: DrhResponse):
+        """Handle the response of a request."""
+
+        self._running = False
+        QApplication.restoreOverrideCursor()
+        resp = response.getfullresponse()
 
         # Handle the response.
         if not resp["errors"]:
-            output = [resp["success"][-1]["detail"]]
-            if self._delivery == "both":
-                output.append(resp["success"][-2]["detail"])
+            saved = [s["detail"] for s in resp["success"] if s["type"] == "save"]
+            output = saved[-2:] if self._runningdelivery == "both" else saved[-1:]
             msg = MessageBox(self.window, MsgType.SUCCESS, MsgTrigger.REQUEST, self.texts, details=output)
             msg.show()
         else:
@@ -0,0 +1,43 @@
+import traceback
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+
+class WorkerSignals(QObject):
+    """Signals emitted by a Worker.
+
+    The object is created in the GUI thread, so that the signals are delivered to the
+    GUI thread, although they are emitted in the worker's thread.
+    """
+
+    finished = Signal(object)
+    failed = Signal(str)
+
+
+class Worker(QRunnable):
+    """Runnable executing a (long-running) function call in a thread of a QThreadPool.
+
+    When the call has returned, its result is emitted with the signal finished. If the
+    call raised an exception, its traceback is emitted with the signal failed instead.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        """Initialize and return a Worker object.
+
+        :param fn: The function to be called.
+        :param args: The positional arguments of the call.
+        :param kwargs: The keyword arguments of the call.
+        """
+        super().__init__()
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    def run(self):
+        """Call the function and emit the result (or the traceback)."""
+        try:
+            result = self._fn(*self._args, **self._kwargs)
+        except Exception as e:
+            self.signals.failed.emit("".join(traceback.format_exception(e, limit=10)))
+        else:
+            self.signals.finished.emit(result)
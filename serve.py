@@ -0,0 +1,41 @@
+"""Script starting the DIP Request Handler as local HTTP service (see drh.service) instead of the GUI.
+
+Usage (from the repository root):
+    python serve.py --aiproot <dir> [--host 127.0.0.1] [--port 8080] [--output output/] [--workers 4]
+        [--transform 1] [--pack 2] [--keep 24]
+"""
+
+import argparse
+import os
+
+from drh.drh import DIPRequestHandler
+from drh.scheduler import Scheduler
+from drh.service import DrhService
+
+os.environ['SAXONC_HOME'] = os.path.join(os.getcwd(), "saxonpy", "saxonc_home")
+
+confdir = "config/DIP/"
+conf = "profile_conf.json"
+vconfdir = "config/VDIP/"
+vconf = "profile_conf.json"
+index = "cache/aipindex.sqlite"
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--aiproot", required=True, help="Directory, to which the AIP paths of all requests are relative.")
+parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: only the local host).")
+parser.add_argument("--port", type=int, default=8080, help="Port to listen on.")
+parser.add_argument("--output", default="output/", help="Directory for the generated (View)DIPs.")
+parser.add_argument("--workers", type=int, default=4, help="Maximum number of requests running at once.")
+parser.add_argument("--transform", type=int, default=1, help="Maximum number of concurrent transformations.")
+parser.add_argument("--pack", type=int, default=2, help="Maximum number of .tar files written at once.")
+parser.add_argument("--keep", type=float, default=24, help="Hours, for which finished requests and files are kept.")
+args = parser.parse_args()
+
+drh = DIPRequestHandler(confdir, conf, vconfdir, vconf, indexpath=index, precompile=True)
+scheduler = Scheduler(drh, args.workers, {"transform": args.transform, "pack": args.pack})
+service = DrhService(drh, scheduler, args.output, args.aiproot, args.host, args.port, args.keep * 3600)
+print(f"Serving on http://{args.host}:{args.port}/")
+try:
+    service.run()
+except KeyboardInterrupt:
+    scheduler.shutdown(cancel=True)